@@ -1,13 +1,24 @@
+from functools import partial
+
+from flask import request
+
 from .handler import EcgDirectoryHandler
 from ..api_base import BaseNamespace
 
 
 class AnnotationNamespace(BaseNamespace):
+    JOB_LIMITS = {
+        "ECG_GET_ITEM_DATA": (4, 32),
+        "ECG_GET_ITEM_WINDOW": (4, 32),
+    }
+    SERIALIZED_EVENTS = frozenset({"ECG_GOT_ITEM_DATA", "ECG_GOT_ITEM_WINDOW"})
+
     def __init__(self, watch_dir, dump_dir, annotation_list_path, annotation_count_path, submitted_annotation_path,
-                 *args, **kwargs):
+                 *args, handler_options=None, **kwargs):
         super().__init__(*args, **kwargs)
+        handler_options = {} if handler_options is None else handler_options
         self.handler = EcgDirectoryHandler(self, watch_dir, dump_dir, annotation_list_path, annotation_count_path,
-                                           submitted_annotation_path, ignore_directories=True)
+                                           submitted_annotation_path, ignore_directories=True, **handler_options)
 
     def on_ECG_GET_ANNOTATION_LIST(self, data, meta):
         self._safe_call(self.handler._get_annotation_list, data, meta, "ECG_GET_ANNOTATION_LIST",
@@ -20,11 +31,18 @@ class AnnotationNamespace(BaseNamespace):
     def on_ECG_GET_LIST(self, data, meta):
         self._safe_call(self.handler._get_ecg_list, data, meta, "ECG_GET_LIST", "ECG_GOT_LIST")
 
+    def on_ECG_GET_LIST_CHANGES(self, data, meta):
+        self._safe_call(self.handler._get_list_changes, data, meta, "ECG_GET_LIST_CHANGES", "ECG_GOT_LIST_CHANGES")
+
     def on_ECG_GET_ITEM_DATA(self, data, meta):
         self._safe_call(self.handler._get_item_data, data, meta, "ECG_GET_ITEM_DATA", "ECG_GOT_ITEM_DATA")
 
+    def on_ECG_GET_ITEM_WINDOW(self, data, meta):
+        self._safe_call(self.handler._get_item_window, data, meta, "ECG_GET_ITEM_WINDOW", "ECG_GOT_ITEM_WINDOW")
+
     def on_ECG_SET_ANNOTATION(self, data, meta):
         self._safe_call(self.handler._set_annotation, data, meta, "ECG_SET_ANNOTATION")
 
     def on_ECG_DUMP_SIGNALS(self, data, meta):
-        self._safe_call(self.handler._dump_signals, data, meta, "ECG_DUMP_SIGNALS")
+        dump_signals = partial(self.handler._dump_signals, sid=request.sid)
+        self._safe_call(dump_signals, data, meta, "ECG_DUMP_SIGNALS")
@@ -0,0 +1,138 @@
+import os
+import json
+import logging
+import tempfile
+import threading
+from datetime import datetime
+
+import numpy as np
+
+from ..codec import to_builtin
+
+
+class SignalCache:
+    """On-disk cache of parsed ECG signals.
+
+    Signals are stored as ``.counts.npy`` files of ADC counts named by their sha, so they are loaded without any
+    parsing. An index maps absolute file paths to their size, modification time, sha and the meta needed by the
+    handler, including per-lead gains. A cached entry is used only if both the size and the modification time of
+    the file are unchanged.
+    """
+
+    INDEX_NAME = "index.json"
+    SIGNAL_SUFFIX = ".counts.npy"
+    META_KEYS = ("fs", "units", "signame", "gain")
+    TIMESTAMP_FORMAT = "%Y-%m-%dT%H:%M:%S.%f"
+
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+        self.index_path = os.path.join(cache_dir, self.INDEX_NAME)
+        self.logger = logging.getLogger("server." + __name__)
+        self.index = {}
+        self.lock = threading.Lock()
+        os.makedirs(cache_dir, exist_ok=True)
+        self._load_index()
+
+    def _load_index(self):
+        if not os.path.isfile(self.index_path):
+            self.logger.debug("There is no signal cache index in {}".format(self.cache_dir))
+            return
+        try:
+            with open(self.index_path, encoding="utf-8") as json_data:
+                self.index = json.load(json_data)
+        except (OSError, ValueError) as err:
+            self.logger.warning("Signal cache index is corrupted and will be rebuilt: {}".format(err))
+            self.index = {}
+        self.logger.debug("Signal cache index with {} entries is loaded".format(len(self.index)))
+
+    def _signal_path(self, sha):
+        return os.path.join(self.cache_dir, sha + self.SIGNAL_SUFFIX)
+
+    @staticmethod
+    def _get_key(path):
+        return os.path.abspath(path)
+
+    def get(self, path, load_signal=True):
+        with self.lock:
+            entry = self.index.get(self._get_key(path))
+        if entry is None or "gain" not in entry["meta"]:
+            return None
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        if entry["size"] != stat.st_size or entry["modification_time"] != stat.st_mtime:
+            return None
+        signal_path = self._signal_path(entry["sha"])
+        if not os.path.isfile(signal_path):
+            return None
+        meta = dict(entry["meta"])
+        meta["timestamp"] = datetime.strptime(meta["timestamp"], self.TIMESTAMP_FORMAT)
+        signal_data = {
+            "file_name": os.path.basename(path),
+            "file_size": stat.st_size,
+            "modification_time": stat.st_mtime,
+            "meta": meta,
+            "annotation": [],
+        }
+        if load_signal:
+            try:
+                signal_data["signal"] = np.load(signal_path)
+            except (OSError, ValueError) as err:
+                self.logger.warning("Cached signal {} is corrupted and will be rebuilt: {}".format(signal_path, err))
+                self._remove_file(signal_path)
+                return None
+        return entry["sha"], signal_data
+
+    @staticmethod
+    def _remove_file(path):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+    def _save_signal(self, signal_path, signal):
+        """Save the signal to a temporary file and move it into place, so that readers never see partial files."""
+        fd, tmp_path = tempfile.mkstemp(suffix=".tmp", dir=self.cache_dir)
+        try:
+            with os.fdopen(fd, "wb") as f:
+                np.save(f, signal)
+            os.replace(tmp_path, signal_path)
+        except BaseException:
+            self._remove_file(tmp_path)
+            raise
+
+    def put(self, path, sha, signal_data):
+        signal_path = self._signal_path(sha)
+        if not os.path.isfile(signal_path):
+            self._save_signal(signal_path, np.asarray(signal_data["signal"]))
+        meta = {key: signal_data["meta"][key] for key in self.META_KEYS}
+        meta["timestamp"] = signal_data["meta"]["timestamp"].strftime(self.TIMESTAMP_FORMAT)
+        entry = {
+            "size": signal_data["file_size"],
+            "modification_time": signal_data["modification_time"],
+            "sha": sha,
+            "meta": meta,
+        }
+        with self.lock:
+            self.index[self._get_key(path)] = entry
+
+    def prune(self, paths):
+        keys = {self._get_key(path) for path in paths}
+        with self.lock:
+            self.index = {key: entry for key, entry in self.index.items() if key in keys}
+            used_files = {entry["sha"] + self.SIGNAL_SUFFIX for entry in self.index.values()}
+        n_removed = 0
+        for file_name in os.listdir(self.cache_dir):
+            if file_name.endswith(".npy") and file_name not in used_files:
+                os.remove(os.path.join(self.cache_dir, file_name))
+                n_removed += 1
+        self.logger.debug("{} stale signals are removed from the cache".format(n_removed))
+
+    def dump(self):
+        tmp_path = self.index_path + ".tmp"
+        with self.lock:
+            index = dict(self.index)
+        with open(tmp_path, "w", encoding="utf-8") as json_data:
+            json.dump(index, json_data, default=to_builtin)
+        os.replace(tmp_path, self.index_path)
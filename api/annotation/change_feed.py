@@ -0,0 +1,39 @@
+import threading
+from uuid import uuid4
+from collections import deque
+from itertools import islice
+
+
+class ChangeFeed:
+    """Bounded log of ECG list changes with monotonically increasing revisions.
+
+    Revisions are only comparable within the same ``epoch``, which changes on every server start.
+
+    Args:
+        max_changes: number of the latest changes to keep. Clients, that are further behind, have to resync.
+    """
+
+    def __init__(self, max_changes=10000):
+        self.epoch = uuid4().hex
+        self.changes = deque(maxlen=max_changes)
+        self.revision = 0
+        self.lock = threading.Lock()
+
+    def add(self, event, item):
+        with self.lock:
+            self.revision += 1
+            change = {"revision": self.revision, "event": event, "data": item}
+            self.changes.append(change)
+            return change
+
+    def get_since(self, revision, epoch):
+        """Return changes with revisions greater than ``revision`` or None if the client has to resync."""
+        with self.lock:
+            if epoch != self.epoch or revision > self.revision:
+                return None
+            if revision == self.revision:
+                return []
+            if not self.changes or self.changes[0]["revision"] > revision + 1:
+                return None
+            skip = revision + 1 - self.changes[0]["revision"]
+            return list(islice(self.changes, skip, None))
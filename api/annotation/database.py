@@ -0,0 +1,192 @@
+import json
+import sqlite3
+import threading
+from uuid import uuid4
+from datetime import datetime
+from contextlib import contextmanager
+
+from .store import EcgRecord
+
+
+class EcgDatabase:
+    """SQLite store of ECG metadata, annotations and counts of dumped annotations.
+
+    The database is shared by all server processes watching the same directory. It runs in WAL mode, so readers do
+    not block the writer, and every thread gets its own connection. Statements run in ``transaction`` are committed
+    atomically.
+
+    Every write also logs the changed shas along with the id of the writing ``EcgDatabase`` into a table of changes,
+    so other processes fetch only the rows changed by their peers, see ``get_changes``. ``get_data_version`` is a
+    cheap check for new commits, that should precede it. The log keeps the last ``MAX_CHANGES`` changes.
+    """
+
+    TIMESTAMP_FORMAT = "%Y-%m-%dT%H:%M:%S.%f"
+    BUSY_TIMEOUT = 30
+    MAX_CHANGES = 10000
+    COLUMNS = ("sha", "file_name", "file_size", "modification_time", "timestamp", "fs", "units", "signame",
+               "annotation")
+    SCHEMA = (
+        """CREATE TABLE ecg (
+            sha TEXT PRIMARY KEY,
+            file_name TEXT NOT NULL UNIQUE,
+            file_size INTEGER NOT NULL,
+            modification_time REAL NOT NULL,
+            timestamp TEXT NOT NULL,
+            fs NUMERIC NOT NULL,
+            units TEXT NOT NULL,
+            signame TEXT NOT NULL,
+            annotation TEXT
+        )""",
+        "CREATE INDEX ecg_timestamp ON ecg (timestamp)",
+        "CREATE INDEX ecg_annotated ON ecg (sha) WHERE annotation IS NOT NULL",
+        "CREATE TABLE dumped_count (label TEXT PRIMARY KEY, count INTEGER NOT NULL)",
+    )
+    CHANGE_SCHEMA = "CREATE TABLE IF NOT EXISTS change (revision INTEGER PRIMARY KEY, sha TEXT, origin TEXT NOT NULL)"
+
+    def __init__(self, path):
+        self.path = path
+        self.origin = uuid4().hex
+        self.local = threading.local()
+        connection = self._connect()
+        connection.execute("PRAGMA journal_mode = WAL")
+        with self.transaction():
+            self.created = connection.execute("SELECT 1 FROM sqlite_master WHERE name = 'ecg'").fetchone() is None
+            if self.created:
+                for statement in self.SCHEMA:
+                    connection.execute(statement)
+            connection.execute(self.CHANGE_SCHEMA)
+
+    def _connect(self):
+        connection = getattr(self.local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=self.BUSY_TIMEOUT, isolation_level=None)
+            connection.execute("PRAGMA synchronous = NORMAL")
+            self.local.connection = connection
+        return connection
+
+    def _execute(self, statement, params=()):
+        return self._connect().execute(statement, params)
+
+    @contextmanager
+    def transaction(self):
+        """Run the statements of the calling thread in a single write transaction. Nested calls join it."""
+        connection = self._connect()
+        if connection.in_transaction:
+            yield
+            return
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            yield
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+        connection.execute("COMMIT")
+
+    def get_data_version(self):
+        """Get a number, that changes whenever another connection, including the ones of other threads of this
+        process, commits to the database."""
+        return self._execute("PRAGMA data_version").fetchone()[0]
+
+    def _log_changes(self, shas):
+        connection = self._connect()
+        connection.executemany("INSERT INTO change (sha, origin) VALUES (?, ?)", [(sha, self.origin) for sha in shas])
+        connection.execute("DELETE FROM change WHERE revision <= (SELECT max(revision) FROM change) - ?",
+                           (self.MAX_CHANGES,))
+
+    def get_revision(self):
+        """Get the revision of the last logged change."""
+        return self._execute("SELECT coalesce(max(revision), 0) FROM change").fetchone()[0]
+
+    def get_changes(self, revision):
+        """Get changes made by other ``EcgDatabase`` instances after ``revision``.
+
+        Return:
+            the last revision and a set of changed shas, where None stands for a change of dumped counts. The set is
+            None, if some of the changes are already dropped from the log, and everything should be reloaded.
+        """
+        rows = self._execute("SELECT revision, sha, origin FROM change WHERE revision > ? ORDER BY revision",
+                             (revision,)).fetchall()
+        if not rows:
+            return revision, set()
+        if rows[0][0] > revision + 1:
+            return rows[-1][0], None
+        return rows[-1][0], {sha for _, sha, origin in rows if origin != self.origin}
+
+    def _to_row(self, record):
+        annotation = json.dumps(record.annotation, ensure_ascii=False) if record.annotation else None
+        return (record.sha, record.file_name, int(record.file_size), float(record.modification_time),
+                record.timestamp.strftime(self.TIMESTAMP_FORMAT), float(record.fs),
+                json.dumps(record.units, ensure_ascii=False), json.dumps(record.signame, ensure_ascii=False),
+                annotation)
+
+    def _from_row(self, row):
+        sha, file_name, file_size, modification_time, timestamp, fs, units, signame, annotation = row
+        timestamp = datetime.strptime(timestamp, self.TIMESTAMP_FORMAT)
+        annotation = json.loads(annotation) if annotation is not None else None
+        return EcgRecord(sha, file_name, file_size, modification_time, timestamp, fs, json.loads(units),
+                         json.loads(signame), annotation)
+
+    def get_record(self, sha):
+        statement = "SELECT {} FROM ecg WHERE sha = ?".format(", ".join(self.COLUMNS))
+        row = self._execute(statement, (sha,)).fetchone()
+        return self._from_row(row) if row is not None else None
+
+    def get_records(self, annotated=False):
+        statement = "SELECT {} FROM ecg".format(", ".join(self.COLUMNS))
+        if annotated:
+            statement += " WHERE annotation IS NOT NULL"
+        return [self._from_row(row) for row in self._execute(statement + " ORDER BY rowid")]
+
+    def put_records(self, records):
+        """Insert records, replacing the ones with the same sha or file name."""
+        records = list(records)
+        if not records:
+            return
+        statement = "INSERT OR REPLACE INTO ecg ({}) VALUES ({})".format(", ".join(self.COLUMNS),
+                                                                        ", ".join("?" * len(self.COLUMNS)))
+        with self.transaction():
+            replaced_shas = self._get_shas_by_file_names([record.file_name for record in records])
+            self._connect().executemany(statement, [self._to_row(record) for record in records])
+            self._log_changes(replaced_shas | {record.sha for record in records})
+
+    def _get_shas_by_file_names(self, file_names):
+        return {sha for file_name in file_names
+                for sha, in self._execute("SELECT sha FROM ecg WHERE file_name = ?", (file_name,))}
+
+    def put_record(self, record):
+        self.put_records([record])
+
+    def remove_records(self, shas):
+        shas = list(shas)
+        if not shas:
+            return
+        with self.transaction():
+            self._connect().executemany("DELETE FROM ecg WHERE sha = ?", [(sha,) for sha in shas])
+            self._log_changes(shas)
+
+    def remove_record(self, sha):
+        self.remove_records([sha])
+
+    def rename_record(self, file_name, new_file_name):
+        with self.transaction():
+            shas = self._get_shas_by_file_names([file_name, new_file_name])
+            self._execute("UPDATE OR REPLACE ecg SET file_name = ? WHERE file_name = ?", (new_file_name, file_name))
+            self._log_changes(shas)
+
+    def set_annotation(self, sha, annotation):
+        annotation = json.dumps(annotation, ensure_ascii=False) if annotation else None
+        with self.transaction():
+            self._execute("UPDATE ecg SET annotation = ? WHERE sha = ?", (annotation, sha))
+            self._log_changes([sha])
+
+    def get_dumped_counts(self):
+        return dict(self._execute("SELECT label, count FROM dumped_count"))
+
+    def add_dumped_counts(self, counts):
+        counts = [(count, label) for label, count in counts.items()]
+        with self.transaction():
+            connection = self._connect()
+            connection.executemany("INSERT OR IGNORE INTO dumped_count (count, label) VALUES (0, ?)",
+                                   [(label,) for _, label in counts])
+            connection.executemany("UPDATE dumped_count SET count = count + ? WHERE label = ?", counts)
+            self._log_changes([None])
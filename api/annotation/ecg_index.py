@@ -0,0 +1,145 @@
+from bisect import bisect_left, insort
+from datetime import datetime, timedelta
+from itertools import count, islice
+
+
+class _SortedList:
+    """Sorted list, split into buckets of up to ``2 * load`` items.
+
+    Insertion and removal shift a single bucket, so they take O(log n + load) time. Positions are ``(bucket, index)``
+    pairs, that compare in the list order.
+    """
+
+    def __init__(self, load=1000):
+        self.load = load
+        self.buckets = []
+        self.maxes = []
+
+    def end(self):
+        return len(self.buckets), 0
+
+    def locate(self, item):
+        """Get the position of the first item not less than ``item``."""
+        i = bisect_left(self.maxes, item)
+        if i == len(self.maxes):
+            return self.end()
+        return i, bisect_left(self.buckets[i], item)
+
+    def add(self, item):
+        if not self.buckets:
+            self.buckets.append([item])
+            self.maxes.append(item)
+            return
+        i = min(bisect_left(self.maxes, item), len(self.maxes) - 1)
+        bucket = self.buckets[i]
+        insort(bucket, item)
+        self.maxes[i] = bucket[-1]
+        if len(bucket) > 2 * self.load:
+            self.buckets[i:i + 1] = [bucket[:self.load], bucket[self.load:]]
+            self.maxes[i:i + 1] = [bucket[self.load - 1], bucket[-1]]
+
+    def remove(self, item):
+        i, j = self.locate(item)
+        bucket = self.buckets[i]
+        del bucket[j]
+        if bucket:
+            self.maxes[i] = bucket[-1]
+        else:
+            del self.buckets[i]
+            del self.maxes[i]
+
+    def count(self, start, stop):
+        """Count items between the positions ``start`` and ``stop``."""
+        (i, j), (k, m) = start, stop
+        if i == k:
+            return m - j
+        return len(self.buckets[i]) - j + sum(len(bucket) for bucket in self.buckets[i + 1:k]) + m
+
+    def iter_reversed(self, start, stop):
+        """Iterate over items between the positions ``start`` and ``stop`` in the reverse order."""
+        (i, j), (k, m) = start, stop
+        for b in range(min(k, len(self.buckets) - 1), i - 1, -1):
+            bucket = self.buckets[b]
+            for position in range((m if b == k else len(bucket)) - 1, (j if b == i else 0) - 1, -1):
+                yield bucket[position]
+
+
+class EcgIndex:
+    """Index of ECGs, sorted by their timestamps in descending order.
+
+    ECGs with equal timestamps keep the order of insertion. Timestamps are formatted once on insertion. Both
+    insertion and removal cost a binary search and a shift of a single bucket of the sorted list of keys.
+    """
+
+    TIMESTAMP_FORMAT = "%d.%m.%Y %H:%M:%S"
+    DATE_FORMAT = "%d.%m.%Y"
+
+    def __init__(self):
+        self.keys = _SortedList()
+        self.items = {}
+        self.counter = count()
+
+    def __len__(self):
+        return len(self.items)
+
+    def __contains__(self, sha):
+        return sha in self.items
+
+    def insert(self, sha, timestamp):
+        if sha in self.items:
+            return
+        key = (timestamp, -next(self.counter), sha)
+        self.keys.add(key)
+        self.items[sha] = (key, timestamp.strftime(self.TIMESTAMP_FORMAT))
+
+    def remove(self, sha):
+        item = self.items.pop(sha, None)
+        if item is None:
+            return
+        self.keys.remove(item[0])
+
+    def get_timestamp(self, sha):
+        return self.items[sha][1]
+
+    def get_next(self, sha, n):
+        """Return up to ``n`` ECGs following ``sha`` in the list order."""
+        position = self.keys.locate(self.items[sha][0])
+        return [key[-1] for key in islice(self.keys.iter_reversed((0, 0), position), n)]
+
+    @classmethod
+    def parse_date(cls, value, is_end=False):
+        try:
+            return datetime.strptime(value, cls.TIMESTAMP_FORMAT)
+        except ValueError:
+            pass
+        try:
+            date = datetime.strptime(value, cls.DATE_FORMAT)
+        except ValueError:
+            raise ValueError("Invalid date {}".format(value))
+        return date + timedelta(days=1) if is_end else date
+
+    def query(self, date_from=None, date_to=None, predicate=None, offset=0, limit=None):
+        """Get a page of ECGs in the list order.
+
+        Args:
+            date_from: datetime, only ECGs recorded at this time or later are returned.
+            date_to: datetime, only ECGs recorded before this time are returned.
+            predicate: callable, that takes a sha and returns whether the ECG should be returned.
+            offset: number of matching ECGs to skip.
+            limit: maximum number of ECGs to return.
+
+        Return:
+            a list of shas and the total number of matching ECGs.
+        """
+        start = (0, 0) if date_from is None else self.keys.locate((date_from,))
+        stop = self.keys.end() if date_to is None else self.keys.locate((date_to,))
+        if stop <= start:
+            return [], 0
+        shas = (key[-1] for key in self.keys.iter_reversed(start, stop))
+        if predicate is None:
+            total = self.keys.count(start, stop)
+        else:
+            shas = [sha for sha in shas if predicate(sha)]
+            total = len(shas)
+        stop = None if limit is None else offset + limit
+        return list(islice(shas, offset, stop)), total
@@ -2,30 +2,63 @@ import os
 import re
 import stat
 import json
-import shutil
 import logging
+import zipfile
+import time
 import threading
+import multiprocessing
+from functools import partial
 from datetime import datetime
-from collections import OrderedDict
+from collections import Counter, OrderedDict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 
 import numpy as np
 import pandas as pd
 from watchdog.observers import Observer
-from watchdog.events import FileSystemEvent, RegexMatchingEventHandler
+from watchdog.events import RegexMatchingEventHandler
 
-from .loader import load_data
+from .cache import SignalCache
+from .change_feed import ChangeFeed
+from .database import EcgDatabase
+from .ecg_index import EcgIndex
+from .ingest import IngestQueue, split_stable_files
+from .loader import load_data, load_many
+from .rwlock import ReadWriteLock
+from .store import EcgRecord, RecordStore
+from ..lru import LruCache
+from ..metrics import metrics
+from ..pyramid import SignalPyramid, parse_window
 
 
-def synchronized(method):
+def _remove_readonly(path):
+    try:
+        os.remove(path)
+    except PermissionError:
+        os.chmod(path, stat.S_IWRITE)
+        os.remove(path)
+
+
+def read_locked(method):
     def decorated(self, *args, **kwargs):
-        with self.lock:
+        with self.lock.read():
+            return method(self, *args, **kwargs)
+    return decorated
+
+
+def write_locked(method):
+    def decorated(self, *args, **kwargs):
+        with self.lock.write():
             return method(self, *args, **kwargs)
     return decorated
 
 
 class EcgDirectoryHandler(RegexMatchingEventHandler):
+    REFRESH_INTERVAL = 0.5
+    MAX_INGEST_ATTEMPTS = 5
+
     def __init__(self, namespace, watch_dir, dump_dir, annotation_list_path, annotation_count_path,
-                 submitted_annotation_path, *args, **kwargs):
+                 submitted_annotation_path, *args, cache_dir=None, n_workers=1,
+                 signal_cache_bytes=256 * 2**20, n_prefetch=2, ingest_window=0.5, database_path=None, **kwargs):
         self.pattern = "^.+\.xml$"
         super().__init__([self.pattern], *args, **kwargs)
         self.namespace = namespace
@@ -35,21 +68,45 @@ class EcgDirectoryHandler(RegexMatchingEventHandler):
         self.annotation_count_path = annotation_count_path
         self.submitted_annotation_path = submitted_annotation_path
         self.logger = logging.getLogger("server." + __name__)
-        self.lock = threading.RLock()
+        self.lock = ReadWriteLock(on_wait=partial(metrics.observe, "lock_wait_seconds"))
+        self.cache = SignalCache(cache_dir) if cache_dir is not None else None
+        self.n_workers = n_workers
+        self.pyramids = LruCache(signal_cache_bytes)
+        self.n_prefetch = n_prefetch
+        self.prefetch_executor = ThreadPoolExecutor(max_workers=1)
+        if database_path is None:
+            database_path = os.path.splitext(submitted_annotation_path)[0] + ".sqlite"
+        self.db = EcgDatabase(database_path)
+        # workers are spawned, as forking would copy the locks held by the watchdog, refresh and prefetch threads
+        self.ingest_executor = None
+        if n_workers > 1:
+            self.ingest_executor = ProcessPoolExecutor(n_workers, mp_context=multiprocessing.get_context("spawn"))
+        self.ingest_attempts = {}
 
-        self.data = OrderedDict()
+        self.records = RecordStore()
+        self.feed = ChangeFeed()
+        self.common_annotations = None
         self.annotation_dict = {}
         self.annotation_count_dict = OrderedDict()
+        self.dumped_counts = {}
+        self.revision = 0
         self.dumped_signals = set()
+        self.dump_in_progress = False
 
         self.logger.info("Initial loading started")
         self._load_annotation_list()
+        submitted_annotation = self._import_legacy_annotation() if self.db.created else {}
         self._load_data()
+        self._sync_database(submitted_annotation)
         self._load_annotation_count()
-        self._load_submitted_annotation()
+        self.common_annotations = self._compute_common_annotations()
         self.logger.info("Initial loading finished")
         self._log_data()
 
+        self.refresh_thread = threading.Thread(target=self._refresh_loop, daemon=True)
+        self.refresh_thread.start()
+        self.ingest = IngestQueue(self._process_events, ingest_window)
+
         self.logger.info("Launching directory observer")
         self.observer = Observer()
         self.observer.schedule(self, self.watch_dir)
@@ -57,8 +114,8 @@ class EcgDirectoryHandler(RegexMatchingEventHandler):
         self.logger.info("Directory observer launched")
 
     def _log_data(self):
-        file_names = [signal_data["file_name"] for sha, signal_data in self.data.items()]
-        self.logger.debug("{} ECGs are stored: {}".format(len(self.data), ", ".join(file_names)))
+        file_names = [record.file_name for record in self.records]
+        self.logger.debug("{} ECGs are stored: {}".format(len(self.records), ", ".join(file_names)))
 
     def _load_annotation_list(self):
         with open(self.annotation_list_path, encoding="utf-8") as json_data:
@@ -77,84 +134,307 @@ class EcgDirectoryHandler(RegexMatchingEventHandler):
     def _load_data(self):
         path_gen = (os.path.join(self.watch_dir, f) for f in sorted(os.listdir(self.watch_dir))
                     if re.match(self.pattern, f) is not None)
-        for path in path_gen:
-            self._update_data(path)
+        paths = list(path_gen)
+        if self.cache is not None:
+            self.cache.prune(paths)
+        loaded_data = self._load_files(paths)
+        for path in paths:
+            self._merge_data(path, *loaded_data[path])
+        self._dump_cache()
+
+    def _load_files(self, paths):
+        loaded_data = {}
+        if self.cache is not None:
+            for path in paths:
+                cached_data = self.cache.get(path, load_signal=False)
+                if cached_data is not None:
+                    loaded_data[path] = cached_data
+            self.logger.debug("{} files are loaded from the cache".format(len(loaded_data)))
+        paths = [path for path in paths if path not in loaded_data]
+        if paths:
+            self.logger.debug("Loading {} files with {} processes".format(len(paths), self.n_workers))
+        self._store_loaded_files(paths, load_many(paths, self.n_workers), loaded_data)
+        return loaded_data
+
+    def _store_loaded_files(self, paths, results, loaded_data):
+        for path, (sha, signal_data) in zip(paths, results):
+            if self.cache is not None:
+                self.cache.put(path, sha, signal_data)
+            self._evict_signal(sha, signal_data)
+            loaded_data[path] = (sha, signal_data)
+
+    def _dump_cache(self):
+        if self.cache is not None:
+            self.cache.dump()
 
     def _load_annotation_count(self):
-        if not os.path.isfile(self.annotation_count_path):
-            self.logger.debug("There is no annotation count file")
-            return
-        with open(self.annotation_count_path, encoding="utf-8") as json_data:
-            annotation_count_dict = json.load(json_data)
-        for annotation in self.annotation_count_dict:
-            self.annotation_count_dict[annotation] += annotation_count_dict.get(annotation, 0)
+        self.dumped_counts = self.db.get_dumped_counts()
+        self._count_annotations()
         self.logger.debug("Counts for submitted annotations are loaded")
 
-    def _load_submitted_annotation(self):
-        if not os.path.isfile(self.submitted_annotation_path):
-            self.logger.debug("There are no submitted annotations")
-            return
-        df = pd.read_feather(self.submitted_annotation_path).set_index("index")
-        counts = df.sum()
+    def _count_annotations(self):
         for annotation in self.annotation_count_dict:
-            self.annotation_count_dict[annotation] += int(counts.get(annotation, 0))
-        n_loaded = 0
-        for sha, signal_data in self.data.items():
-            if signal_data["file_name"] in df.index:
-                annotation = df.loc[signal_data["file_name"]]
-                annotation = annotation[annotation != 0].index.tolist()
+            self.annotation_count_dict[annotation] = self.dumped_counts.get(annotation, 0)
+        for record in self.records:
+            self._update_annotation_count(record.annotation, 1)
+
+    def _update_annotation_count(self, annotation, increment):
+        for label in annotation:
+            if label in self.annotation_count_dict:
+                self.annotation_count_dict[label] += increment
+
+    def _import_legacy_annotation(self):
+        """Import annotation counts and submitted annotations of versions, that kept them in files, into the new
+        database. Return submitted annotations by file names."""
+        if os.path.isfile(self.annotation_count_path):
+            with open(self.annotation_count_path, encoding="utf-8") as json_data:
+                self.db.add_dumped_counts(json.load(json_data))
+            self.logger.info("Annotation counts are imported from {}".format(self.annotation_count_path))
+        submitted_annotation = OrderedDict()
+        if os.path.isfile(self.submitted_annotation_path):
+            df = pd.read_feather(self.submitted_annotation_path).set_index("index")
+            for file_name, annotation in df.iterrows():
+                submitted_annotation[file_name] = annotation[annotation != 0].index.tolist()
+            self.logger.info("Submitted annotations are imported from {}".format(self.submitted_annotation_path))
+        journal_path = self.submitted_annotation_path + ".journal"
+        for path in (journal_path + ".old", journal_path):
+            if not os.path.isfile(path):
+                continue
+            with open(path, encoding="utf-8") as journal:
+                for line in journal:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        break
+                    submitted_annotation[record["file_name"]] = record["annotation"]
+            self.logger.info("Annotation journal {} is imported".format(path))
+        return submitted_annotation
+
+    def _sync_database(self, submitted_annotation):
+        """Bring the database in line with ECGs in ``watch_dir`` and load their annotations from it.
+
+        Other server processes may have changed both the directory and the database since it was listed, so files
+        are checked again inside the transaction: records of files, that are gone, are dropped, and rows of files,
+        that were added by other processes meanwhile, are taken over.
+        """
+        with self.db.transaction():
+            stored_records = {record.sha: record for record in self.db.get_records()}
+            for record in list(self.records):
+                if not os.path.isfile(os.path.join(self.watch_dir, record.file_name)):
+                    self.records.remove(record.sha)
+            removed_shas = []
+            for sha, stored_record in stored_records.items():
+                if sha in self.records:
+                    continue
+                if os.path.isfile(os.path.join(self.watch_dir, stored_record.file_name)):
+                    self.records.add(stored_record)
+                else:
+                    removed_shas.append(sha)
+            self.db.remove_records(removed_shas)
+            n_loaded = 0
+            changed_records = []
+            for record in self.records:
+                stored_record = stored_records.get(record.sha)
+                if stored_record is not None:
+                    annotation = stored_record.annotation
+                else:
+                    annotation = submitted_annotation.get(record.file_name, [])
                 diff = sorted(set(annotation) - set(self.annotation_count_dict.keys()))
                 if diff:
                     debug_str = "Submitted annotation for signal {} contains unknown values {} and will not be used"
-                    self.logger.debug(debug_str.format(signal_data["file_name"], ", ".join(diff)))
-                else:
-                    signal_data["annotation"] = annotation
-                    n_loaded += 1
+                    self.logger.debug(debug_str.format(record.file_name, ", ".join(diff)))
+                    annotation = []
+                record.annotation = annotation
+                n_loaded += bool(annotation)
+                if stored_record is None or self._is_record_changed(stored_record, record):
+                    changed_records.append(record)
+            self.db.put_records(changed_records)
+            self.revision = self.db.get_revision()
         self.logger.debug("Submitted annotations for {} signals are loaded".format(n_loaded))
 
+    @staticmethod
+    def _is_record_changed(stored_record, record):
+        return (stored_record.file_name != record.file_name or stored_record.file_size != record.file_size or
+                stored_record.modification_time != record.modification_time or
+                stored_record.annotation != record.annotation)
+
     def _remove_file(self, path):
         self.logger.debug("The same ECG already exists, deleting the file {}".format(path))
-        os.remove(path)
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            self.logger.debug("The file {} is already deleted by another server process".format(path))
 
-    def _update_data(self, path, retries=1, timeout=0.1):
+    def _load_file(self, path, retries=1, timeout=0.1):
+        cached_data = self.cache.get(path) if self.cache is not None else None
+        if cached_data is not None:
+            self.logger.debug("Loading the file {} from the cache".format(path))
+            return cached_data
         sha, signal_data = load_data(path, retries, timeout)
-        existing_data = self.data.get(sha)
-        if existing_data is None:
-            self.data[sha] = signal_data
-        elif existing_data["modification_time"] > signal_data["modification_time"]:
-            if existing_data["annotation"]:
-                signal_data["annotation"] = existing_data["annotation"]
-                self._dump_annotation()
-            self.data[sha] = signal_data
-            self._remove_file(os.path.join(self.watch_dir, existing_data["file_name"]))
+        if self.cache is not None:
+            self.cache.put(path, sha, signal_data)
+        return sha, signal_data
+
+    def _evict_signal(self, sha, signal_data):
+        signal = signal_data.pop("signal", None)
+        if signal is not None:
+            self.pyramids.put(sha, SignalPyramid(signal, gain=signal_data["meta"]["gain"]))
+
+    def _get_pyramid(self, sha, path):
+        pyramid = self.pyramids.get(sha)
+        if pyramid is None:
+            pyramid = self._load_pyramid(sha, path)
+        return pyramid
+
+    def _load_pyramid(self, sha, path):
+        _, signal_data = self._load_file(path)
+        pyramid = SignalPyramid(signal_data["signal"], gain=signal_data["meta"]["gain"])
+        self.pyramids.put(sha, pyramid)
+        return pyramid
+
+    def _prefetch_signal(self, sha, path):
+        if sha in self.pyramids:
+            return
+        try:
+            self._load_pyramid(sha, path)
+        except Exception as error:
+            self.logger.debug("Prefetching the file {} failed: {}".format(path, error))
+
+    def _get_prefetch_paths(self, sha):
+        return [(next_sha, os.path.join(self.watch_dir, self.records.get(next_sha).file_name))
+                for next_sha in self.records.index.get_next(sha, self.n_prefetch)]
+
+    def _prefetch(self, prefetch_paths):
+        for sha, path in prefetch_paths:
+            if sha not in self.pyramids:
+                self.prefetch_executor.submit(self._prefetch_signal, sha, path)
+
+    def _merge_data(self, path, sha, signal_data):
+        record = EcgRecord.from_signal_data(sha, signal_data)
+        existing_record = self.records.get(sha)
+        if existing_record is None:
+            self.records.add(record)
+            return True
+        elif existing_record.file_name == record.file_name:
+            return False
+        elif existing_record.modification_time > record.modification_time:
+            record.annotation = existing_record.annotation
+            self.records.add(record)
+            self._remove_file(os.path.join(self.watch_dir, existing_record.file_name))
         else:
             self._remove_file(path)
+        return False
 
     def _encode_annotation(self, annotation):
         return np.isin(list(self.annotation_count_dict.keys()), annotation).astype(int)
 
-    def _dump_annotation(self):
-        annotations = []
-        for sha, signal_data in self.data.items():
-            if signal_data["annotation"]:
-                annotations.append((signal_data["file_name"], self._encode_annotation(signal_data["annotation"])))
-        if not annotations:
-            self.logger.info("No annotation to dump")
-            return
+    def _write_annotation(self, annotations, path):
         index, annotations = zip(*annotations)
-        annotations = np.array(annotations)
+        annotations = np.array([self._encode_annotation(annotation) for annotation in annotations])
         self.logger.info("Dumping annotations for {}".format(", ".join(index)))
         df = pd.DataFrame(annotations, index=index, columns=list(self.annotation_count_dict.keys())).reset_index()
-        df.to_feather(self.submitted_annotation_path)
-        self.logger.info("Dump finished into {}".format(self.submitted_annotation_path))
+        tmp_path = path + ".tmp"
+        df.to_feather(tmp_path)
+        os.replace(tmp_path, path)
+        self.logger.info("Dump finished into {}".format(path))
+
+    def _store_created_record(self, sha):
+        """Write a created record to the database. If the ECG is already stored, e.g. by another server process,
+        the stored annotation is kept."""
+        record = self.records.get(sha)
+        stored_record = self.db.get_record(sha)
+        if stored_record is not None and stored_record.annotation != record.annotation:
+            self._update_annotation_count(record.annotation, -1)
+            record.annotation = stored_record.annotation
+            self._update_annotation_count(record.annotation, 1)
+        self.db.put_record(record)
+
+    def _apply_stored_record(self, sha, stored_record):
+        record = self.records.get(sha)
+        if stored_record is None:
+            if record is not None:
+                self.records.remove(sha)
+                self._update_annotation_count(record.annotation, -1)
+                self._emit_change("ECG_LIST_ITEM_REMOVED", {"id": sha})
+            return
+        if record is None:
+            self.records.add(stored_record)
+            self._update_annotation_count(stored_record.annotation, 1)
+            self._emit_change("ECG_LIST_ITEM_ADDED", self._get_list_item(sha))
+            return
+        if record.file_name != stored_record.file_name:
+            self.records.rename(record.file_name, stored_record.file_name)
+        if record.annotation != stored_record.annotation:
+            was_annotated = bool(record.annotation)
+            self._update_annotation_count(record.annotation, -1)
+            record.annotation = stored_record.annotation
+            self._update_annotation_count(record.annotation, 1)
+            if was_annotated != bool(record.annotation):
+                self._emit_change("ECG_LIST_ITEM_UPDATED", self._get_list_item(sha))
+
+    def _refresh(self, shas=None):
+        """Apply changes of given shas, made to the database by other server processes, or reload all records if
+        ``shas`` is None. A None sha stands for a change of dumped counts."""
+        with self.lock.write():
+            if shas is None:
+                stored_records = OrderedDict((record.sha, record) for record in self.db.get_records())
+                for record in list(self.records):
+                    if record.sha not in stored_records:
+                        self._apply_stored_record(record.sha, None)
+                for sha, stored_record in stored_records.items():
+                    self._apply_stored_record(sha, stored_record)
+            else:
+                for sha in shas - {None}:
+                    self._apply_stored_record(sha, self.db.get_record(sha))
+            if shas is None or None in shas:
+                self.dumped_counts = self.db.get_dumped_counts()
+                self._count_annotations()
+        self._update_common_annotation_list()
 
-    @synchronized
+    def _refresh_loop(self):
+        data_version = self.db.get_data_version()
+        while True:
+            time.sleep(self.REFRESH_INTERVAL)
+            try:
+                current_version = self.db.get_data_version()
+                if current_version == data_version:
+                    continue
+                data_version = current_version
+                self.revision, shas = self.db.get_changes(self.revision)
+                if shas is None or shas:
+                    self._refresh(shas)
+            except Exception as error:
+                self.logger.exception(error)
+
+    @read_locked
     def _get_annotation_list(self, data, meta):
         data = [{"id": group, "annotations": annotations} for group, annotations in self.annotation_dict.items()]
         return dict(data=data, meta=meta)
 
-    @synchronized
+    def _get_list_item(self, sha):
+        return {
+            "id": sha,
+            "timestamp": self.records.index.get_timestamp(sha),
+            "isAnnotated": bool(self.records.get(sha).annotation),
+        }
+
+    def _emit_change(self, event, item):
+        change = self.feed.add(event, item)
+        self.namespace.emit(event, dict(change, epoch=self.feed.epoch))
+
+    def _update_common_annotation_list(self):
+        with self.lock.read():
+            common_annotations = self._compute_common_annotations()
+        if common_annotations != self.common_annotations:
+            self.common_annotations = common_annotations
+            self.namespace.on_ECG_GET_COMMON_ANNOTATION_LIST({}, {})
+
+    @read_locked
     def _get_common_annotation_list(self, data, meta):
+        data = {"annotations": self._compute_common_annotations()}
+        return dict(data=data, meta=meta)
+
+    def _compute_common_annotations(self):
         N_TOP = 5
         STOPWORDS = ["Неинтерпретируемая ЭКГ", "Другая патология", "Другая патология из этой группы"]
         DEFAULTS = ["Нормальный ритм"]
@@ -165,42 +445,88 @@ class EcgDirectoryHandler(RegexMatchingEventHandler):
             if default not in annotations:
                 annotations.append(default)
         annotations = annotations[:N_TOP]
-        data = {"annotations": annotations}
         self.logger.debug("Top {} most common annotations: {}".format(N_TOP, ", ".join(annotations)))
-        return dict(data=data, meta=meta)
+        return annotations
 
-    @synchronized
+    def _get_list_filter(self, data):
+        annotated = data.get("annotated")
+        label = data.get("annotation")
+        if label is not None and label not in self.annotation_count_dict:
+            raise ValueError("Unknown annotation: {}".format(label))
+        if annotated is None and label is None:
+            return None
+
+        def predicate(sha):
+            annotation = self.records.get(sha).annotation
+            if annotated is not None and bool(annotation) != bool(annotated):
+                return False
+            return label is None or label in annotation
+        return predicate
+
+    @staticmethod
+    def _get_list_bounds(data):
+        offset = data.get("offset", 0)
+        limit = data.get("limit")
+        if not isinstance(offset, int) or offset < 0:
+            raise ValueError("Invalid offset {}".format(offset))
+        if limit is not None and (not isinstance(limit, int) or limit < 0):
+            raise ValueError("Invalid limit {}".format(limit))
+        return offset, limit
+
+    @read_locked
     def _get_ecg_list(self, data, meta):
-        ecg_list = []
-        for sha, signal_data in self.data.items():
-            ecg_data = {
-                "id": sha,
-                "timestamp": signal_data["meta"]["timestamp"],
-                "isAnnotated": bool(signal_data["annotation"]),
-            }
-            ecg_list.append(ecg_data)
-        ecg_list = sorted(ecg_list, key=lambda val: val["timestamp"], reverse=True)
-        for ecg_data in ecg_list:
-            ecg_data["timestamp"] = ecg_data["timestamp"].strftime("%d.%m.%Y %H:%M:%S")
-        return dict(data=ecg_list, meta=meta)
-
-    @synchronized
+        offset, limit = self._get_list_bounds(data)
+        date_from = data.get("date_from")
+        date_from = EcgIndex.parse_date(date_from) if date_from is not None else None
+        date_to = data.get("date_to")
+        date_to = EcgIndex.parse_date(date_to, is_end=True) if date_to is not None else None
+        shas, total = self.records.index.query(date_from, date_to, self._get_list_filter(data), offset, limit)
+        ecg_list = [self._get_list_item(sha) for sha in shas]
+        return dict(data=ecg_list, meta=meta, total=total, revision=self.feed.revision, epoch=self.feed.epoch)
+
+    @read_locked
+    def _get_list_changes(self, data, meta):
+        revision = data.get("revision")
+        if not isinstance(revision, int):
+            raise ValueError("Invalid revision {}".format(revision))
+        changes = self.feed.get_since(revision, data.get("epoch"))
+        return dict(data=changes, meta=meta, revision=self.feed.revision, epoch=self.feed.epoch)
+
     def _get_item_data(self, data, meta):
         sha = data.get("id")
-        if sha is None or sha not in self.data:
-            raise ValueError("Invalid sha {}".format(sha))
-        signal_data = self.data[sha]
-        data["signal"] = signal_data["signal"]
-        data["frequency"] = signal_data["meta"]["fs"]
-        data["units"] = signal_data["meta"]["units"]
-        data["signame"] = signal_data["meta"]["signame"]
-        data["annotation"] = signal_data["annotation"]
+        with self.lock.read():
+            record = self.records.get(sha)
+            if record is None:
+                raise ValueError("Invalid sha {}".format(sha))
+            path = os.path.join(self.watch_dir, record.file_name)
+            data["frequency"] = record.fs
+            data["units"] = record.units
+            data["signame"] = record.signame
+            data["annotation"] = record.annotation
+            prefetch_paths = self._get_prefetch_paths(sha)
+        data["signal"] = self._get_pyramid(sha, path).get_signal(data.get("format"))
+        self._prefetch(prefetch_paths)
         return dict(data=data, meta=meta)
 
-    @synchronized
+    def _get_item_window(self, data, meta):
+        sha = data.get("id")
+        start, end, max_points = parse_window(data)
+        with self.lock.read():
+            record = self.records.get(sha)
+            if record is None:
+                raise ValueError("Invalid sha {}".format(sha))
+            path = os.path.join(self.watch_dir, record.file_name)
+            data["frequency"] = record.fs
+            data["units"] = record.units
+            data["signame"] = record.signame
+        data["window"] = self._get_pyramid(sha, path).get_window(start, end, max_points, data.get("format"))
+        return dict(data=data, meta=meta)
+
+    @write_locked
     def _set_annotation(self, data, meta):
         sha = data.get("id")
-        if sha is None or sha not in self.data:
+        record = self.records.get(sha)
+        if record is None:
             raise ValueError("Invalid sha {}".format(sha))
         annotation = data.get("annotation")
         if annotation is None:
@@ -208,99 +534,201 @@ class EcgDirectoryHandler(RegexMatchingEventHandler):
         unknown_annotation = [ann for ann in annotation if ann not in self.annotation_count_dict]
         if unknown_annotation:
             raise ValueError("Unknown annotation: {}".format(", ".join(unknown_annotation)))
-        for old_annotation in self.data[sha]["annotation"]:
-            self.annotation_count_dict[old_annotation] -= 1
-        self.data[sha]["annotation"] = annotation
-        for new_annotation in self.data[sha]["annotation"]:
-            self.annotation_count_dict[new_annotation] += 1
-        self._dump_annotation()
-        self.namespace.on_ECG_GET_COMMON_ANNOTATION_LIST({}, {})
-
-    @synchronized
-    def _dump_signals(self, data, meta):
-        annotated_signals = {signal_data["file_name"] for sha, signal_data in self.data.items()
-                             if signal_data["annotation"]}
-        if not annotated_signals:
-            self.logger.info("No annotated signals to dump")
-            return
-        self.logger.info("Dumping the following signals: {}".format(", ".join(sorted(annotated_signals))))
-        self.dumped_signals |= annotated_signals
-        dir_name = datetime.now().strftime("%Y-%m-%d-%H-%M-%S")
-        dump_dir = os.path.join(self.dump_dir, dir_name)
-        os.makedirs(dump_dir)
-        annotation_file = os.path.basename(self.submitted_annotation_path)
-        shutil.move(self.submitted_annotation_path, os.path.join(dump_dir, annotation_file))
-
-        data = OrderedDict()
-        for sha, signal_data in self.data.items():
-            if signal_data["annotation"]:
-                shutil.move(os.path.join(self.watch_dir, signal_data["file_name"]),
-                            os.path.join(dump_dir, signal_data["file_name"]))
-            else:
-                data[sha] = signal_data
-        self.data = data
-        archive_name = shutil.make_archive(dump_dir, "zip", dump_dir)
+        was_annotated = bool(record.annotation)
+        self.db.set_annotation(sha, annotation)
+        self._update_annotation_count(record.annotation, -1)
+        record.annotation = annotation
+        self._update_annotation_count(record.annotation, 1)
+        if was_annotated != bool(annotation):
+            self._emit_change("ECG_LIST_ITEM_UPDATED", self._get_list_item(sha))
+        self._update_common_annotation_list()
 
-        def remove_readonly(func, path, _):
-            os.chmod(path, stat.S_IWRITE)
-            func(path)
-        shutil.rmtree(dump_dir, onerror=remove_readonly)
+    def _dump_signals(self, data, meta, sid=None):
+        with self.lock.write():
+            if self.dump_in_progress:
+                raise ValueError("Signals are already being dumped")
+            with self.db.transaction():
+                # the database is shared with other server processes, so annotated signals are taken from it
+                annotated_records = self.db.get_records(annotated=True)
+                if not annotated_records:
+                    self.logger.info("No annotated signals to dump")
+                    return
+                annotated_signals = {record.file_name for record in annotated_records}
+                self.logger.info("Dumping the following signals: {}".format(", ".join(sorted(annotated_signals))))
+                archive_name = os.path.join(self.dump_dir, datetime.now().strftime("%Y-%m-%d-%H-%M-%S"))
+                annotations = [(record.file_name, record.annotation) for record in annotated_records]
+                os.makedirs(self.dump_dir, exist_ok=True)
+                self._write_annotation(annotations, archive_name + ".feather")
+                dumped_counts = Counter(label for record in annotated_records for label in record.annotation)
+                self.db.remove_records([record.sha for record in annotated_records])
+                self.db.add_dumped_counts(dumped_counts)
+            for record in annotated_records:
+                if self.records.remove(record.sha) is not None:
+                    self._emit_change("ECG_LIST_ITEM_REMOVED", {"id": record.sha})
+            self.dumped_signals |= annotated_signals
+            self.dumped_counts = self.db.get_dumped_counts()
+            self._count_annotations()
+            self.dump_in_progress = True
+            self._log_data()
+        args = (annotated_records, archive_name, dumped_counts, meta, sid)
+        threading.Thread(target=self._archive_signals, args=args, daemon=True).start()
 
-        with open(self.annotation_count_path, "w", encoding="utf-8") as json_data:
-            json.dump(self.annotation_count_dict, json_data)
+    def _emit_dump_progress(self, status, n_done, n_total, archive_name, meta, sid):
+        data = {"status": status, "done": n_done, "total": n_total, "archive": os.path.basename(archive_name)}
+        self.namespace.emit("ECG_DUMP_PROGRESS", dict(data=data, meta=meta), room=sid)
 
-        self.logger.info("Dump finished into {}".format(archive_name))
-        self._log_data()
-        self.namespace.on_ECG_GET_LIST({}, {})
+    def _archive_signals(self, records, archive_name, dumped_counts, meta, sid):
+        archive_path = archive_name + ".zip"
+        tmp_path = archive_path + ".part"
+        annotation_path = archive_name + ".feather"
+        n_total = len(records)
+        try:
+            with zipfile.ZipFile(tmp_path, "w", zipfile.ZIP_DEFLATED) as archive:
+                archive.write(annotation_path, os.path.basename(self.submitted_annotation_path))
+                for i, record in enumerate(records):
+                    archive.write(os.path.join(self.watch_dir, record.file_name), record.file_name)
+                    self._emit_dump_progress("running", i + 1, n_total, archive_path, meta, sid)
+            os.replace(tmp_path, archive_path)
+        except Exception as error:
+            self.logger.exception(error)
+            self._rollback_dump(records, dumped_counts, tmp_path, annotation_path)
+            self._emit_dump_progress("failed", 0, n_total, archive_path, meta, sid)
+            return
+        finally:
+            with self.lock.write():
+                self.dump_in_progress = False
+        os.remove(annotation_path)
+        for record in records:
+            try:
+                _remove_readonly(os.path.join(self.watch_dir, record.file_name))
+            except FileNotFoundError:
+                self.logger.debug("The file {} is already deleted by another server process".format(record.file_name))
+        self.logger.info("Dump finished into {}".format(archive_path))
+        self._emit_dump_progress("finished", n_total, n_total, archive_path, meta, sid)
 
-    @synchronized
-    def on_created(self, event):
-        src = os.path.basename(event.src_path)
-        self.logger.info("File created: {}".format(src))
-        self._update_data(event.src_path, retries=5)
-        self._log_data()
-        self.namespace.on_ECG_GET_LIST({}, {})
+    def _rollback_dump(self, records, dumped_counts, tmp_path, annotation_path):
+        self.logger.info("Dump failed, restoring {} signals".format(len(records)))
+        for path in (tmp_path, annotation_path):
+            if os.path.isfile(path):
+                os.remove(path)
+        with self.lock.write():
+            with self.db.transaction():
+                self.db.put_records(records)
+                self.db.add_dumped_counts({label: -count for label, count in dumped_counts.items()})
+            for record in records:
+                self.dumped_signals.discard(record.file_name)
+                self.records.add(record)
+                self._emit_change("ECG_LIST_ITEM_ADDED", self._get_list_item(record.sha))
+            self.dumped_counts = self.db.get_dumped_counts()
+            self._count_annotations()
 
-    @synchronized
-    def on_deleted(self, event):
-        src = os.path.basename(event.src_path)
+    def _load_created_files(self, paths):
+        stable_paths, unstable_paths = split_stable_files(paths)
+        for path in unstable_paths:
+            self._retry_ingest(path, "File {} is still being written".format(os.path.basename(path)))
+        loaded_data = {}
+        futures = {}
+        for path in stable_paths:
+            cached_data = self.cache.get(path) if self.cache is not None else None
+            if cached_data is not None:
+                loaded_data[path] = cached_data
+            elif self.ingest_executor is not None:
+                futures[path] = self.ingest_executor.submit(load_data, path)
+            else:
+                futures[path] = None
+        for path, future in futures.items():
+            try:
+                sha, signal_data = future.result() if future is not None else load_data(path)
+            except Exception as error:
+                self._retry_ingest(path, "Loading the file {} failed: {}".format(os.path.basename(path), error))
+                continue
+            if self.cache is not None:
+                try:
+                    self.cache.put(path, sha, signal_data)
+                except OSError as error:
+                    self.logger.warning("Caching the file {} failed: {}".format(os.path.basename(path), error))
+            loaded_data[path] = (sha, signal_data)
+        for path, (sha, signal_data) in loaded_data.items():
+            self.ingest_attempts.pop(path, None)
+            self._evict_signal(sha, signal_data)
+        return loaded_data
+
+    def _retry_ingest(self, path, reason):
+        n_attempts = self.ingest_attempts.get(path, 0) + 1
+        if n_attempts >= self.MAX_INGEST_ATTEMPTS or not os.path.isfile(path):
+            self.ingest_attempts.pop(path, None)
+            self.logger.warning("{}, the file is skipped".format(reason))
+            return
+        self.ingest_attempts[path] = n_attempts
+        self.logger.debug("{}, retrying".format(reason))
+        self.ingest.put("created", path)
+
+    def _delete_file(self, src):
+        record = self.records.get_by_file_name(src)
         if src in self.dumped_signals:
             self.dumped_signals.remove(src)
-            return
+            # a dumped record is already removed, unless another process has stored it again while it was archived
+            if record is None:
+                return False
         self.logger.info("File deleted: {}".format(src))
+        if record is None:
+            return False
+        self.records.remove(record.sha)
+        self.db.remove_record(record.sha)
+        self._emit_change("ECG_LIST_ITEM_REMOVED", {"id": record.sha})
+        if not record.annotation:
+            return False
+        self._update_annotation_count(record.annotation, -1)
+        return True
+
+    def _rename_file(self, src, dst):
+        self.logger.info("File renamed: {} -> {}".format(src, dst))
+        if self.records.rename(src, dst) is not None:
+            self.db.rename_record(src, dst)
+
+    def _process_event(self, kind, src, dest, loaded_data):
+        if kind == "created":
+            if src in loaded_data:
+                self.logger.info("File created: {}".format(os.path.basename(src)))
+                sha, signal_data = loaded_data[src]
+                is_new = self._merge_data(src, sha, signal_data)
+                self._store_created_record(sha)
+                if is_new:
+                    self._emit_change("ECG_LIST_ITEM_ADDED", self._get_list_item(sha))
+        elif kind == "deleted":
+            return self._delete_file(os.path.basename(src))
+        elif kind == "moved":
+            self._rename_file(os.path.basename(src), os.path.basename(dest))
+        return False
+
+    def _process_events(self, events):
+        created_paths = [src for kind, src, dest in events if kind == "created"]
+        loaded_data = self._load_created_files(created_paths)
         need_dump = False
-        data = OrderedDict()
-        for sha, signal_data in self.data.items():
-            if signal_data["file_name"] != src:
-                data[sha] = signal_data
-            elif signal_data["annotation"]:
-                for annotation in signal_data["annotation"]:
-                    self.annotation_count_dict[annotation] -= 1
-                need_dump = True
-        self.data = data
+        with self.lock.write(), self.db.transaction():
+            for kind, src, dest in events:
+                try:
+                    need_dump |= self._process_event(kind, src, dest, loaded_data)
+                except Exception as error:
+                    self.logger.error("Processing the {} event of the file {} failed".format(kind, src))
+                    self.logger.exception(error)
+            self._log_data()
+        self._dump_cache()
         if need_dump:
-            self._dump_annotation()
-            self.namespace.on_ECG_GET_COMMON_ANNOTATION_LIST({}, {})
-        self._log_data()
-        self.namespace.on_ECG_GET_LIST({}, {})
+            self._update_common_annotation_list()
+
+    def on_created(self, event):
+        self.ingest.put("created", event.src_path)
+
+    def on_deleted(self, event):
+        self.ingest.put("deleted", event.src_path)
 
-    @synchronized
     def on_moved(self, event):
-        src = os.path.basename(event.src_path)
-        src_match = re.match(self.pattern, src) is not None
-        dst = os.path.basename(event.dest_path)
-        dst_match = re.match(self.pattern, dst) is not None
+        src_match = re.match(self.pattern, os.path.basename(event.src_path)) is not None
+        dst_match = re.match(self.pattern, os.path.basename(event.dest_path)) is not None
         if not src_match and dst_match:
-            return self.on_created(FileSystemEvent(event.dest_path))
+            self.ingest.put("created", event.dest_path)
         elif src_match and not dst_match:
-            return self.on_deleted(FileSystemEvent(event.src_path))
-        self.logger.info("File renamed: {} -> {}".format(src, dst))
-        need_dump = False
-        for sha, signal_data in self.data.items():
-            if signal_data["file_name"] == src:
-                signal_data["file_name"] = dst
-                need_dump = bool(signal_data["annotation"])
-        if need_dump:
-            self._dump_annotation()
-        self._log_data()
-        self.namespace.on_ECG_GET_LIST({}, {})
+            self.ingest.put("deleted", event.src_path)
+        else:
+            self.ingest.put("moved", event.src_path, event.dest_path)
@@ -0,0 +1,107 @@
+import os
+import time
+import logging
+import threading
+
+
+def _get_file_state(path):
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return stat.st_size, stat.st_mtime
+
+
+def split_stable_files(paths, interval=0.1, timeout=5):
+    """Wait until sizes and modification times of files stop changing.
+
+    All files are polled together, so the waiting time does not grow with the number of files.
+
+    Return:
+        a tuple of lists of files, that are stable and that are still being written after the timeout. Files, that
+        disappear while waiting, are dropped.
+    """
+    states = {path: _get_file_state(path) for path in paths}
+    stable = []
+    deadline = time.monotonic() + timeout
+    while states:
+        time.sleep(interval)
+        new_states = {}
+        for path, state in states.items():
+            new_state = _get_file_state(path)
+            if new_state is None:
+                continue
+            if new_state == state:
+                stable.append(path)
+            else:
+                new_states[path] = new_state
+        states = new_states
+        if time.monotonic() > deadline:
+            break
+    order = {path: i for i, path in enumerate(paths)}
+    return sorted(stable, key=order.get), list(states)
+
+
+def coalesce_events(events):
+    """Remove redundant events from a batch.
+
+    Repeated creation events are merged into the first one, a file, that is created and then renamed within the
+    batch, is created under its final name, and creation of a file, that is deleted within the batch, is dropped.
+
+    Args:
+        events: list of ``(kind, src_path, dest_path)`` tuples, where ``kind`` is one of "created", "deleted" and
+            "moved".
+    """
+    coalesced = []
+    created = {}
+    for kind, src, dest in events:
+        if kind == "created":
+            if src in created:
+                continue
+            created[src] = len(coalesced)
+        elif kind == "moved" and src in created:
+            position = created.pop(src)
+            coalesced[position] = None
+            if dest not in created:
+                created[dest] = len(coalesced)
+                coalesced.append(("created", dest, None))
+            continue
+        elif kind == "deleted" and src in created:
+            coalesced[created.pop(src)] = None
+        coalesced.append((kind, src, dest))
+    return [event for event in coalesced if event is not None]
+
+
+class IngestQueue:
+    """Queue of file system events, that are passed to ``process_batch`` in batches.
+
+    A batch is formed from all events received within ``window`` seconds after the first one, so a burst of events
+    is processed at once.
+    """
+
+    def __init__(self, process_batch, window=0.5):
+        self.process_batch = process_batch
+        self.window = window
+        self.logger = logging.getLogger("server." + __name__)
+        self.events = []
+        self.condition = threading.Condition()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def put(self, kind, src, dest=None):
+        with self.condition:
+            self.events.append((kind, src, dest))
+            self.condition.notify()
+
+    def _run(self):
+        while True:
+            with self.condition:
+                while not self.events:
+                    self.condition.wait()
+            time.sleep(self.window)
+            with self.condition:
+                events, self.events = self.events, []
+            try:
+                self.process_batch(coalesce_events(events))
+            except Exception as error:
+                self.logger.exception(error)
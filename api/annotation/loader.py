@@ -1,8 +1,12 @@
+import io
 import os
 import sys
 import time
 import logging
+import multiprocessing
 from hashlib import sha256
+from functools import lru_cache, partial
+from concurrent.futures import ProcessPoolExecutor
 
 import numpy as np
 
@@ -20,14 +24,56 @@ def sha256_checksum(path, block_size=2**16):
     return sha.hexdigest()
 
 
-def _convert_units(signal, meta, units):
-    old_units = meta["units"]
-    new_units = [units] * len(old_units)
-    multiplier = [get_multiplier(old, new) for old, new in zip(old_units, new_units)]
-    multiplier = np.array(multiplier).reshape(-1, 1)
-    signal *= multiplier
-    meta["units"] = np.asarray(new_units)
-    return signal, meta
+INT16_MAX = np.iinfo(np.int16).max
+
+
+@lru_cache(maxsize=None)
+def _get_multiplier(old_units, new_units):
+    return get_multiplier(old_units, new_units)
+
+
+def _to_counts(signal, meta, units):
+    """Store the signal as int16 ADC counts with per-lead gains to ``units`` in ``meta["gain"]``.
+
+    Signals, that are not integral or do not fit into int16, are kept in their original dtype.
+    """
+    gain = [float(_get_multiplier(old_units, units)) for old_units in meta["units"]]
+    if signal.size and np.abs(signal).max() <= INT16_MAX:
+        counts = signal.astype(np.int16)
+        if np.array_equal(counts, signal):
+            signal = counts
+    meta["units"] = [units] * len(gain)
+    meta["gain"] = gain
+    return np.ascontiguousarray(signal), meta
+
+
+def _read_file(path):
+    with open(path, "rb") as f:
+        stat = os.fstat(f.fileno())
+        buffer = f.read()
+    return buffer, stat
+
+
+# Whether load_xml_schiller accepts file objects. Older cardio versions open the path themselves, which is
+# detected on the first parsed file.
+_schiller_accepts_files = None
+
+
+def _parse_schiller(buffer, path):
+    global _schiller_accepts_files
+    if _schiller_accepts_files is False:
+        return load_xml_schiller(path, ["signal", "meta"])
+    try:
+        result = load_xml_schiller(io.BytesIO(buffer), ["signal", "meta"])
+    except TypeError:
+        if _schiller_accepts_files:
+            raise
+        # the error is due to file objects support only if parsing by path succeeds
+        result = load_xml_schiller(path, ["signal", "meta"])
+        _schiller_accepts_files = False
+    else:
+        _schiller_accepts_files = True
+    return result
 
 
 def _load_signal(path, retries=1, timeout=0.1):
@@ -36,30 +82,47 @@ def _load_signal(path, retries=1, timeout=0.1):
     logger.debug("Loading the file from {}".format(path))
     for _ in range(retries):
         try:
-            signal, meta = load_xml_schiller(path, ["signal", "meta"])
+            buffer, stat = _read_file(path)
+            signal, meta = _parse_schiller(buffer, path)
         except Exception as err:
             logger.debug("Loading failed, retrying after {} seconds".format(timeout))
             last_err = err
             time.sleep(timeout)
         else:
-            signal, meta = _convert_units(signal, meta, "mV")
-            signal = signal.tolist()
-            meta["units"] = meta["units"].tolist()
+            signal, meta = _to_counts(signal, meta, "mV")
             meta["signame"] = meta["signame"].tolist()
             logger.debug("Loading finished")
-            return signal, meta
+            return signal, meta, buffer, stat
     else:
         raise last_err
 
 
 def load_data(path, retries=1, timeout=0.1):
-    signal, meta = _load_signal(path, retries, timeout)
-    sha = sha256_checksum(path)
+    signal, meta, buffer, stat = _load_signal(path, retries, timeout)
+    sha = sha256(buffer).hexdigest()
     signal_data = {
         "file_name": os.path.basename(path),
-        "modification_time": os.path.getmtime(path),
+        "file_size": stat.st_size,
+        "modification_time": stat.st_mtime,
         "signal": signal,
         "meta": meta,
         "annotation": [],
     }
     return sha, signal_data
+
+
+def load_many(paths, n_workers=1, retries=1, timeout=0.1):
+    """Load several files, yielding ``(sha, signal_data)`` pairs in the order of ``paths``.
+
+    If ``n_workers`` is greater than 1, files are parsed and hashed in a process pool, and are sent to workers in
+    chunks to amortize the inter-process communication overhead. Workers are spawned rather than forked, so that
+    they do not inherit locks held by other threads of the server.
+    """
+    if n_workers > 1 and len(paths) > 1:
+        chunksize = max(1, len(paths) // (4 * n_workers))
+        load_fn = partial(load_data, retries=retries, timeout=timeout)
+        with ProcessPoolExecutor(max_workers=n_workers, mp_context=multiprocessing.get_context("spawn")) as executor:
+            yield from executor.map(load_fn, paths, chunksize=chunksize)
+    else:
+        for path in paths:
+            yield load_data(path, retries, timeout)
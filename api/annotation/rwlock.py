@@ -0,0 +1,88 @@
+import time
+import threading
+from contextlib import contextmanager
+
+
+class ReadWriteLock:
+    """Reentrant reader/writer lock with writer preference.
+
+    Any number of threads can hold the lock for reading, while writing is exclusive. New readers wait if a writer is
+    waiting, unless they already hold the lock, so that writers are not starved. The writer can reacquire the lock
+    both for reading and writing, but a reader can not be upgraded to a writer.
+
+    Args:
+        on_wait: callable, that takes "read" or "write" and the time in seconds, spent waiting for the lock.
+    """
+
+    def __init__(self, on_wait=None):
+        self.on_wait = on_wait
+        self.condition = threading.Condition(threading.Lock())
+        self.n_readers = 0
+        self.n_waiting_writers = 0
+        self.writer = None
+        self.n_writes = 0
+        self.local = threading.local()
+
+    def _get_n_reads(self):
+        return getattr(self.local, "n_reads", 0)
+
+    def acquire_read(self):
+        n_reads = self._get_n_reads()
+        me = threading.get_ident()
+        started_at = time.perf_counter()
+        with self.condition:
+            if self.writer != me and n_reads == 0:
+                while self.writer is not None or self.n_waiting_writers:
+                    self.condition.wait()
+            self.n_readers += 1
+        self.local.n_reads = n_reads + 1
+        if self.on_wait is not None:
+            self.on_wait("read", time.perf_counter() - started_at)
+
+    def release_read(self):
+        self.local.n_reads = self._get_n_reads() - 1
+        with self.condition:
+            self.n_readers -= 1
+            if self.n_readers == 0:
+                self.condition.notify_all()
+
+    def acquire_write(self):
+        me = threading.get_ident()
+        started_at = time.perf_counter()
+        with self.condition:
+            if self.writer == me:
+                self.n_writes += 1
+                return
+            if self._get_n_reads():
+                raise RuntimeError("A read lock can not be upgraded to a write lock")
+            self.n_waiting_writers += 1
+            while self.writer is not None or self.n_readers:
+                self.condition.wait()
+            self.n_waiting_writers -= 1
+            self.writer = me
+            self.n_writes = 1
+        if self.on_wait is not None:
+            self.on_wait("write", time.perf_counter() - started_at)
+
+    def release_write(self):
+        with self.condition:
+            self.n_writes -= 1
+            if self.n_writes == 0:
+                self.writer = None
+                self.condition.notify_all()
+
+    @contextmanager
+    def read(self):
+        self.acquire_read()
+        try:
+            yield
+        finally:
+            self.release_read()
+
+    @contextmanager
+    def write(self):
+        self.acquire_write()
+        try:
+            yield
+        finally:
+            self.release_write()
@@ -0,0 +1,75 @@
+from .ecg_index import EcgIndex
+
+
+class EcgRecord:
+    """Metadata and annotation of a single ECG. The signal itself is not stored."""
+
+    __slots__ = ("sha", "file_name", "file_size", "modification_time", "timestamp", "fs", "units", "signame",
+                 "annotation")
+
+    def __init__(self, sha, file_name, file_size, modification_time, timestamp, fs, units, signame, annotation=None):
+        self.sha = sha
+        self.file_name = file_name
+        self.file_size = file_size
+        self.modification_time = modification_time
+        self.timestamp = timestamp
+        self.fs = fs
+        self.units = units
+        self.signame = signame
+        self.annotation = [] if annotation is None else annotation
+
+    @classmethod
+    def from_signal_data(cls, sha, signal_data):
+        meta = signal_data["meta"]
+        return cls(sha, signal_data["file_name"], signal_data["file_size"], signal_data["modification_time"],
+                   meta["timestamp"], meta["fs"], meta["units"], meta["signame"], signal_data["annotation"])
+
+
+class RecordStore:
+    """In-memory store of ECG records with O(1) access by sha and by file name.
+
+    Records are iterated in the order of insertion. The store also maintains an ``EcgIndex`` of its records.
+    """
+
+    def __init__(self):
+        self.records = {}
+        self.file_names = {}
+        self.index = EcgIndex()
+
+    def __len__(self):
+        return len(self.records)
+
+    def __contains__(self, sha):
+        return sha in self.records
+
+    def __iter__(self):
+        return iter(self.records.values())
+
+    def get(self, sha):
+        return self.records.get(sha)
+
+    def get_by_file_name(self, file_name):
+        return self.file_names.get(file_name)
+
+    def add(self, record):
+        """Add a record or replace the record with the same sha, keeping its position."""
+        existing_record = self.records.get(record.sha)
+        if existing_record is not None:
+            self.file_names.pop(existing_record.file_name, None)
+        self.records[record.sha] = record
+        self.file_names[record.file_name] = record
+        self.index.insert(record.sha, record.timestamp)
+
+    def remove(self, sha):
+        record = self.records.pop(sha, None)
+        if record is not None:
+            self.file_names.pop(record.file_name, None)
+            self.index.remove(sha)
+        return record
+
+    def rename(self, file_name, new_file_name):
+        record = self.file_names.pop(file_name, None)
+        if record is not None:
+            record.file_name = new_file_name
+            self.file_names[new_file_name] = record
+        return record
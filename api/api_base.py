@@ -1,27 +1,308 @@
+import os
+import time
+import queue
 import logging
+import threading
+from uuid import uuid4
+from functools import partial
+from collections import defaultdict, deque
 
-from flask import request
+from flask import request, has_request_context
 from flask_socketio import Namespace
 
+from .metrics import SIZE_BUCKETS, get_payload_size, metrics
+from .serializer import create_serializer
+
+
+class Job:
+    def __init__(self, job_id, event, sid, target, key=None, on_cancel=None):
+        self.job_id = job_id
+        self.event = event
+        self.sid = sid
+        self.target = target
+        self.key = key
+        self.on_cancel = on_cancel
+        self.cancelled = False
+
+
+class JobExecutor:
+    """Executor of slow event handlers with per-event concurrency limits.
+
+    Jobs of an event beyond its limit of running jobs wait in a per-event queue and are rejected once the queue is
+    full. A cancelled job is dropped from the queue, or has its result discarded if it is already running. Its
+    ``on_cancel`` callback lets a running job stop early. A job with a key replaces jobs of the same event and key,
+    which are cancelled on its submission.
+
+    Args:
+        limits: dict, that maps an event to the maximum numbers of running and queued jobs.
+        spawn: callable, that runs a function with given arguments in the background.
+    """
+
+    def __init__(self, limits, spawn):
+        self.limits = limits
+        self.spawn = spawn
+        self.lock = threading.Lock()
+        self.jobs = {}
+        self.n_running = defaultdict(int)
+        self.queues = defaultdict(deque)
+
+    def __contains__(self, event):
+        return event in self.limits
+
+    def submit(self, job_id, event, sid, target, key=None, on_cancel=None):
+        job = Job(job_id, event, sid, target, key, on_cancel)
+        if key is not None:
+            with self.lock:
+                replaced_ids = [replaced.job_id for replaced in self.jobs.values()
+                                if replaced.event == event and replaced.key == key]
+            for replaced_id in replaced_ids:
+                self.cancel(replaced_id)
+        max_running, max_queued = self.limits[event]
+        with self.lock:
+            if self.n_running[event] < max_running:
+                self._start(job)
+            elif len(self.queues[event]) < max_queued:
+                self.queues[event].append(job)
+            else:
+                raise RuntimeError("Too many {} requests are pending, try again later".format(event))
+            self.jobs[job_id] = job
+
+    def _start(self, job):
+        self.n_running[job.event] += 1
+        self.spawn(self._run, job)
+
+    def _run(self, job):
+        try:
+            job.target(job)
+        finally:
+            with self.lock:
+                self.jobs.pop(job.job_id, None)
+                self.n_running[job.event] -= 1
+                pending = self.queues[job.event]
+                if pending:
+                    self._start(pending.popleft())
+
+    def cancel(self, job_id):
+        with self.lock:
+            job = self.jobs.pop(job_id, None)
+            if job is None:
+                return False
+            job.cancelled = True
+            pending = self.queues[job.event]
+            is_running = job not in pending
+            if not is_running:
+                pending.remove(job)
+        if is_running and job.on_cancel is not None:
+            job.on_cancel()
+        return True
+
+    def cancel_sid(self, sid):
+        with self.lock:
+            job_ids = [job_id for job_id, job in self.jobs.items() if job.sid == sid]
+        return sum(self.cancel(job_id) for job_id in job_ids)
+
 
 class BaseNamespace(Namespace):
-    def __init__(self, *args, **kwargs):
+    """Socket.IO namespace, that handles events inline or as background jobs, limited by ``JOB_LIMITS``."""
+
+    JOB_LIMITS = {}
+    SERIALIZED_EVENTS = frozenset()
+    SIZE_SAMPLE_RATE = 10
+
+    def __init__(self, *args, job_limits=None, **kwargs):
         super().__init__(*args, **kwargs)
         self.logger = logging.getLogger("server." + __name__)
+        self.jobs = JobExecutor(self.JOB_LIMITS if job_limits is None else job_limits, self._spawn)
+        self.emit_queue = queue.Queue()
+        # native threads wake the relay by writing to the pipe, which green threads can wait on without blocking
+        self.relay_fd, self.wakeup_fd = os.pipe()
+        os.set_blocking(self.wakeup_fd, False)
+        self.relay_started = False
+        self.serializers = {}
+
+    def _spawn(self, target, *args):
+        self.socketio.start_background_task(target, *args)
+
+    def _is_green(self):
+        return self.socketio is not None and self.socketio.async_mode in ("eventlet", "gevent")
+
+    def emit(self, *args, **kwargs):
+        """Emit an event. Green servers can not emit from native threads, so such emits are queued and relayed by
+        ``_relay_emits``, which starts with the first connection."""
+        if self._is_green() and threading.current_thread() is not threading.main_thread():
+            if self.relay_started:
+                self.emit_queue.put((args, kwargs))
+                try:
+                    os.write(self.wakeup_fd, b"\0")
+                except BlockingIOError:
+                    # the pipe is full of wakeups, that are not read yet, so the relay is going to wake anyway
+                    pass
+            return
+        super().emit(*args, **kwargs)
+
+    def _wait_readable(self, fd):
+        if self.socketio.async_mode == "eventlet":
+            from eventlet.hubs import trampoline
+            trampoline(fd, read=True)
+        else:
+            from gevent.socket import wait_read
+            wait_read(fd)
+
+    def _relay_emits(self):
+        while True:
+            self._wait_readable(self.relay_fd)
+            os.read(self.relay_fd, 2**16)
+            while True:
+                try:
+                    args, kwargs = self.emit_queue.get_nowait()
+                except queue.Empty:
+                    break
+                try:
+                    super().emit(*args, **kwargs)
+                except Exception as error:
+                    self.logger.exception(error)
+
+    def _run_blocking(self, func, *args):
+        if self.socketio.async_mode == "eventlet":
+            from eventlet import tpool
+            return tpool.execute(func, *args)
+        return func(*args)
+
+    def _get_serializer(self, event, sid):
+        return self.serializers.get(sid) if event in self.SERIALIZED_EVENTS else None
+
+    def emit_serialized(self, event, payload, sid):
+        """Emit a payload to a client, serialized if the client has chosen a binary serializer for the event."""
+        serializer = self._get_serializer(event, sid)
+        if serializer is not None:
+            payload = serializer.serialize(payload)
+        self.emit(event, payload, room=sid)
+
+    def _set_serializer(self, sid):
+        """Choose a serializer of ``SERIALIZED_EVENTS`` for a client by "serializer" and "compression" query
+        parameters, see ``api.serializer.create_serializer``."""
+        name = request.args.get("serializer")
+        compression = request.args.get("compression")
+        try:
+            serializer = create_serializer(name, compression)
+        except (ValueError, ImportError) as error:
+            self.logger.warning("User {} falls back to json: {}".format(sid, error))
+            return
+        if serializer.name != "json":
+            self.serializers[sid] = serializer
+            self.logger.info("User {} uses {} serializer".format(sid, serializer.name))
 
     def on_connect(self):
         self.logger.info("User connected {}".format(request.sid))
+        self._set_serializer(request.sid)
+        if self._is_green() and not self.relay_started:
+            self.relay_started = True
+            self.socketio.start_background_task(self._relay_emits)
 
     def on_disconnect(self):
         self.logger.info("User disconnected {}".format(request.sid))
+        self.serializers.pop(request.sid, None)
+        n_cancelled = self.jobs.cancel_sid(request.sid)
+        if n_cancelled:
+            self.logger.info("{} jobs of user {} are cancelled".format(n_cancelled, request.sid))
+
+    def get_status(self):
+        """Report whether the namespace is ready to handle events, on "SERVER_GET_STATUS" and over HTTP."""
+        return {"status": "ready"}
+
+    def on_SERVER_GET_STATUS(self, data, meta):
+        self._safe_call(self._get_status, data, meta, "SERVER_GET_STATUS", "SERVER_GOT_STATUS")
+
+    def _get_status(self, data, meta):
+        return dict(data=self.get_status(), meta=meta)
+
+    def on_SERVER_METRICS(self, data, meta):
+        self._safe_call(self._get_metrics, data, meta, "SERVER_METRICS", "SERVER_METRICS")
+
+    def _get_metrics(self, data, meta):
+        return dict(data=metrics.snapshot(), meta=meta)
+
+    def on_CANCEL_JOB(self, data, meta):
+        self._safe_call(self._cancel_job, data, meta, "CANCEL_JOB")
+
+    def _cancel_job(self, data, meta):
+        job_id = data.get("job_id")
+        if not self.jobs.cancel(job_id):
+            raise ValueError("Unknown job {}".format(job_id))
+
+    def _safe_call(self, method, data, meta, event_in, event_out=None, job_key=None, on_cancel=None):
+        """Handle an event by ``method`` and emit its result as ``event_out``.
+
+        Events in ``JOB_LIMITS`` run as jobs, in the native thread pool under eventlet. The client is sent a
+        "JOB_SUBMITTED" event with the job id, which is also added to the response meta, and can cancel the job with
+        "CANCEL_JOB". ``job_key`` cancels the jobs of the same event and key, and ``on_cancel`` lets a running job
+        stop early.
+
+        Responses to ``SERIALIZED_EVENTS`` are serialized off the event loop and sent to the requesting client only.
+        Their requests default to the "ndarray" array format for clients with a binary serializer, while other
+        clients get "ndarray" arrays as lists.
+
+        Every event is measured, and the size of every ``SIZE_SAMPLE_RATE``-th response is sampled.
+        """
+        received_at = time.perf_counter()
+        metrics.increment("events_total", event_in)
+        self.logger.debug("Handling event %s. Data: %s. Meta: %s.", event_in, data, meta)
+        sid = request.sid if has_request_context() else None
+        if isinstance(data, dict):
+            if self._get_serializer(event_out, sid) is not None:
+                if data.get("format") is None:
+                    data["format"] = "ndarray"
+            elif data.get("format") == "ndarray":
+                # raw arrays can only be packed by a binary serializer
+                data["format"] = "json"
+        if event_in not in self.jobs:
+            self._call(method, data, meta, event_in, event_out, received_at, sid)
+            return
+        job_id = uuid4().hex
+        meta = dict(meta or {}, job_id=job_id)
+        try:
+            self.jobs.submit(job_id, event_in, sid,
+                             partial(self._run_job, method, data, meta, event_in, event_out, received_at, sid),
+                             job_key, on_cancel)
+        except Exception as error:
+            metrics.increment("rejected_total", event_in)
+            self.emit("ERROR", str(error))
+            self.logger.warning("Event {} is rejected: {}".format(event_in, error))
+            return
+        self.emit("JOB_SUBMITTED", {"job_id": job_id, "event": event_in}, room=sid)
+
+    def _run_job(self, method, data, meta, event_in, event_out, received_at, sid, job):
+        metrics.observe("queue_seconds", event_in, time.perf_counter() - received_at)
+        if job.cancelled:
+            metrics.increment("cancelled_total", event_in)
+            return
+        self._call(method, data, meta, event_in, event_out, received_at, sid, job)
 
-    def _safe_call(self, method, data, meta, event_in, event_out=None):
-        self.logger.info("Handling event {}. Data: {}. Meta: {}.".format(event_in, data, meta))
+    def _call(self, method, data, meta, event_in, event_out, received_at, sid=None, job=None):
         try:
-            payload = method(data, meta)
+            started_at = time.perf_counter()
+            payload = method(data, meta) if job is None else self._run_blocking(method, data, meta)
+            handled_at = time.perf_counter()
+            metrics.observe("handler_seconds", event_in, handled_at - started_at)
+            if job is not None and job.cancelled:
+                metrics.increment("cancelled_total", event_in)
+                self.logger.info("Job {} is cancelled, dropping its result".format(job.job_id))
+                return
             if event_out is not None:
-                self.emit(event_out, payload)
-                self.logger.info("Sending response {}. Meta: {}".format(event_out, meta))
+                serializer = self._get_serializer(event_out, sid)
+                if serializer is None:
+                    self.emit(event_out, payload)
+                else:
+                    serialize = serializer.serialize
+                    payload = serialize(payload) if job is None else self._run_blocking(serialize, payload)
+                    self.emit(event_out, payload, room=sid)
+                metrics.observe("emit_seconds", event_in, time.perf_counter() - handled_at)
+                if (metrics.get_count("events_total", event_in) - 1) % self.SIZE_SAMPLE_RATE == 0:
+                    metrics.observe("response_bytes", event_out, get_payload_size(payload), SIZE_BUCKETS)
+                self.logger.debug("Sending response %s. Meta: %s", event_out, meta)
         except Exception as error:
+            metrics.increment("errors_total", event_in)
             self.emit("ERROR", str(error))
             self.logger.exception(error)
+        finally:
+            metrics.observe("event_seconds", event_in, time.perf_counter() - received_at)
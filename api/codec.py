@@ -0,0 +1,101 @@
+import numpy as np
+
+
+INT16_MAX = np.iinfo(np.int16).max
+UINT8_MAX = np.iinfo(np.uint8).max
+
+
+def _encode_float32(array, window):
+    return array.astype("<f4").tobytes(), {"scale": 1.0}
+
+
+def _encode_int16(array, window):
+    max_abs = float(np.max(np.abs(array))) if array.size else 0.0
+    scale = max_abs / INT16_MAX if max_abs > 0 else 1.0
+    return np.rint(array / scale).astype("<i2").tobytes(), {"scale": scale}
+
+
+def _encode_uint8(array, window):
+    if window is None:
+        window = (float(np.min(array)), float(np.max(array))) if array.size else (0.0, 0.0)
+    low, high = window
+    scale = (high - low) / UINT8_MAX if high > low else 1.0
+    quantized = np.clip(np.rint((array - low) / scale), 0, UINT8_MAX).astype(np.uint8)
+    return quantized.tobytes(), {"scale": scale, "offset": low, "window": [low, high]}
+
+
+BINARY_FORMATS = {
+    "float32": _encode_float32,
+    "int16": _encode_int16,
+    "uint8": _encode_uint8,
+}
+
+
+def encode_array(array, fmt=None, window=None):
+    """Prepare an array for sending over Socket.IO.
+
+    Args:
+        array: array-like to encode.
+        fmt: "json" or None to send the array as nested lists, "float32", "int16" or "uint8" to send it as a
+            little-endian binary attachment. Values of an int16 buffer must be multiplied by "scale" to get the
+            original ones. Values of a uint8 buffer must be multiplied by "scale" and then added to "offset".
+            "ndarray" keeps the array as is for a binary serializer, see ``api.serializer``.
+        window: a pair of values, that are mapped to 0 and 255 by the uint8 format. Values outside the window are
+            clipped. Defaults to the range of the array.
+
+    Return:
+        nested lists for the json format, the array itself for the ndarray format, a dict with "buffer", "shape",
+        "dtype" and "scale" keys otherwise. The uint8 format also adds "offset" and "window" keys.
+    """
+    array = np.asarray(array)
+    if fmt is None or fmt == "json":
+        return array.tolist()
+    if fmt == "ndarray":
+        return array
+    encoder = BINARY_FORMATS.get(fmt)
+    if encoder is None:
+        raise ValueError("Unknown array format {}".format(fmt))
+    buffer, params = encoder(array, window)
+    return {
+        "buffer": buffer,
+        "shape": list(array.shape),
+        "dtype": fmt,
+        **params,
+    }
+
+
+def encode_scaled(array, gain=None, fmt=None, window=None):
+    """Prepare ``array * gain`` for sending over Socket.IO, see ``encode_array``.
+
+    The product is computed only when the response is built, so arrays can be stored in a compact dtype. An int16
+    array with a single gain value is sent in the int16 format as is, with the gain as its "scale".
+
+    Args:
+        array: array-like of stored values, e.g. ADC counts.
+        gain: multipliers, that broadcast against ``array``, or None to encode the array as is.
+    """
+    if gain is None:
+        return encode_array(array, fmt, window)
+    array = np.asarray(array)
+    gain = np.asarray(gain, dtype=np.float64)
+    if fmt == "int16" and array.dtype == np.int16 and gain.size and np.all(gain == gain.flat[0]):
+        return {
+            "buffer": array.astype("<i2", copy=False).tobytes(),
+            "shape": list(array.shape),
+            "dtype": fmt,
+            "scale": float(gain.flat[0]),
+        }
+    return encode_array(array * gain, fmt, window)
+
+
+def to_builtin(value):
+    """Convert a NumPy scalar or array to Python objects, e.g. as the ``default`` of ``json.dump``.
+
+    Raises:
+        TypeError: if ``value`` is not a NumPy object.
+    """
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    raise TypeError("Object of type {} is not JSON serializable".format(type(value).__name__))
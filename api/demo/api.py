@@ -1,30 +1,95 @@
-from .ecg_controller import EcgController
-from .ct_controller import CtController
+from functools import partial
+
+from flask import request
+
+from .warm_up import LazyController, warm_up
 from ..api_base import BaseNamespace
 
-# init controller objects
-ecg = EcgController()
-ct = CtController()
+
+def create_ecg_controller():
+    from .ecg_controller import EcgController
+    return EcgController()
+
+
+def create_ct_controller():
+    from .ct_controller import CtController
+    return CtController()
 
 
 class DemoNamespace(BaseNamespace):
+    JOB_LIMITS = {
+        "ECG_GET_ITEM_DATA": (2, 16),
+        "ECG_GET_INFERENCE": (4, 32),
+        "CT_GET_ITEM_DATA": (2, 8),
+        "CT_GET_INFERENCE": (2, 8),
+    }
+    SERIALIZED_EVENTS = frozenset({
+        "ECG_GOT_ITEM_DATA",
+        "ECG_GOT_ITEM_WINDOW",
+        "CT_GOT_ITEM_DATA",
+        "CT_GOT_INFERENCE",
+        "CT_INFERENCE_PROGRESS",
+    })
+
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
+        # controllers load models and data in the background, so that the server starts at once
+        self.ecg = LazyController("ECG", create_ecg_controller)
+        self.ct = LazyController("CT", create_ct_controller)
+        warm_up([self.ecg, self.ct], on_ready=self._emit_status)
+
+    def get_status(self):
+        controllers = {controller.name: controller.status for controller in (self.ecg, self.ct)}
+        if any(status == "failed" for status in controllers.values()):
+            status = "failed"
+        elif all(status == "ready" for status in controllers.values()):
+            status = "ready"
+        else:
+            status = "warming up"
+        return {"status": status, "controllers": controllers}
+
+    def _emit_status(self):
+        if self.socketio is None:
+            return
+        self.emit("SERVER_GOT_STATUS", dict(data=self.get_status(), meta={}))
+
+    def on_disconnect(self):
+        super().on_disconnect()
+        if self.ct.status == "ready":
+            self.ct.get().cancel_client_inference(request.sid)
 
     def on_ECG_GET_LIST(self, data, meta):
-        self._safe_call(ecg.get_list, data, meta, "ECG_GET_LIST", "ECG_GOT_LIST")
+        self._safe_call(self.ecg.method("get_list"), data, meta, "ECG_GET_LIST", "ECG_GOT_LIST")
 
     def on_ECG_GET_ITEM_DATA(self, data, meta):
-        self._safe_call(ecg.get_item_data, data, meta, "ECG_GET_ITEM_DATA", "ECG_GOT_ITEM_DATA")
+        self._safe_call(self.ecg.method("get_item_data"), data, meta, "ECG_GET_ITEM_DATA", "ECG_GOT_ITEM_DATA")
+
+    def on_ECG_GET_ITEM_WINDOW(self, data, meta):
+        self._safe_call(self.ecg.method("get_item_window"), data, meta, "ECG_GET_ITEM_WINDOW",
+                        "ECG_GOT_ITEM_WINDOW")
 
     def on_ECG_GET_INFERENCE(self, data, meta):
-        self._safe_call(ecg.get_inference, data, meta, "ECG_GET_INFERENCE", "ECG_GOT_INFERENCE")
+        self._safe_call(self.ecg.method("get_inference"), data, meta, "ECG_GET_INFERENCE", "ECG_GOT_INFERENCE")
 
     def on_CT_GET_LIST(self, data, meta):
-        self._safe_call(ct.get_list, data, meta, "CT_GET_LIST", "CT_GOT_LIST")
+        self._safe_call(self.ct.method("get_list"), data, meta, "CT_GET_LIST", "CT_GOT_LIST")
 
     def on_CT_GET_ITEM_DATA(self, data, meta):
-        self._safe_call(ct.get_item_data, data, meta, "CT_GET_ITEM_DATA", "CT_GOT_ITEM_DATA")
+        self._safe_call(self.ct.method("get_item_data"), data, meta, "CT_GET_ITEM_DATA", "CT_GOT_ITEM_DATA")
 
     def on_CT_GET_INFERENCE(self, data, meta):
-        self._safe_call(ct.get_inference, data, meta, "CT_GET_INFERENCE", "CT_GOT_INFERENCE")
+        progress = partial(self.emit_serialized, "CT_INFERENCE_PROGRESS", sid=request.sid)
+        get_inference = self.ct.method("get_inference", sid=request.sid, progress=progress)
+        # a repeated request of the client for the same scan replaces the previous one, queued or running
+        item_id = data.get("id") if isinstance(data, dict) else None
+        on_cancel = partial(self._cancel_ct_inference, item_id, request.sid)
+        self._safe_call(get_inference, data, meta, "CT_GET_INFERENCE", "CT_GOT_INFERENCE",
+                        job_key=(request.sid, item_id), on_cancel=on_cancel)
+
+    def _cancel_ct_inference(self, item_id, sid):
+        if self.ct.status == "ready":
+            self.ct.get().cancel_inference({"id": item_id}, {}, sid)
+
+    def on_CT_CANCEL_INFERENCE(self, data, meta):
+        cancel_inference = self.ct.method("cancel_inference", sid=request.sid)
+        self._safe_call(cancel_inference, data, meta, "CT_CANCEL_INFERENCE")
@@ -0,0 +1,67 @@
+import time
+import logging
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+
+
+class MicroBatcher:
+    """Scheduler, that groups concurrent requests into batches.
+
+    A batch is formed from all requests received within ``window`` seconds after the first one, but no more than
+    ``max_batch_size`` distinct keys. Requests with the same key share a single result.
+
+    Args:
+        process_batch: callable, that takes a list of distinct keys and returns a dict of results by key.
+        window: time to wait for more requests after the first one in seconds.
+        max_batch_size: maximum number of distinct keys in a batch.
+    """
+
+    def __init__(self, process_batch, window=0.05, max_batch_size=16):
+        self.process_batch = process_batch
+        self.window = window
+        self.max_batch_size = max_batch_size
+        self.logger = logging.getLogger("server." + __name__)
+        self.pending = OrderedDict()
+        self.condition = threading.Condition()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def submit(self, key):
+        future = Future()
+        with self.condition:
+            self.pending.setdefault(key, []).append(future)
+            self.condition.notify()
+        return future
+
+    def _get_batch(self):
+        with self.condition:
+            while not self.pending:
+                self.condition.wait()
+            deadline = time.monotonic() + self.window
+            while len(self.pending) < self.max_batch_size:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                self.condition.wait(timeout)
+            keys = list(self.pending)[:self.max_batch_size]
+            return {key: self.pending.pop(key) for key in keys}
+
+    def _run(self):
+        while True:
+            batch = self._get_batch()
+            self.logger.debug("Processing a batch of {} keys".format(len(batch)))
+            try:
+                results = self.process_batch(list(batch))
+            except Exception as error:
+                self.logger.exception(error)
+                for futures in batch.values():
+                    for future in futures:
+                        future.set_exception(error)
+                continue
+            for key, futures in batch.items():
+                for future in futures:
+                    if key in results:
+                        future.set_result(results[key])
+                    else:
+                        future.set_exception(ValueError("No result for {}".format(key)))
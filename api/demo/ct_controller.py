@@ -1,9 +1,17 @@
 import os
+import tempfile
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
 import numpy as np
 import pandas as pd
 
 from .lung_cancer.dataset import FilesIndex, Pipeline, Dataset
 from .lung_cancer import CTImagesMaskedBatch as CTIMB
+from .ct_index import CtScanIndex
+from .tiling import TiledInference, get_sampling_index, predict_mask_patch
+from ..codec import encode_array
+from ..lru import LruCache
 
 CURRENT_PATH = os.path.dirname(os.path.abspath(__file__))
 
@@ -14,19 +22,31 @@ all_ixs = FilesIndex(path=lunapath, dirs=True)
 # args of actions in pipelines
 # item demonstration
 RENDER_SHAPE = (32, 64, 64)
+RENDER_CACHE_BYTES = 64 * 2**20
+render_cache_path = os.path.join(CURRENT_PATH, 'data', 'ct', 'render_cache')
 
 # inference
 USPACING_SHAPE = (300, 400, 400)
 SPACING = (1., 1., 1.)
 METHOD = 'scipy'
 STRIDES = (32, 64, 64)
+N_WORKERS = 4
 nodules_df = pd.read_csv(os.path.join(CURRENT_PATH, 'data', 'ct', 'annotations', 'annotations.csv'))
+scan_index_path = os.path.join(CURRENT_PATH, 'data', 'ct', 'scan_index.npz')
 
 class CtController:
     def __init__(self):
         # set up the correspondance between ids and backend names
         self.ct_names = dict(zip([str(i) for i in range(len(all_ixs))], all_ixs.indices))
 
+        # one-item datasets are built once, so that requests do not touch the index
+        self.item_datasets = {name: Dataset(index=all_ixs.create_subset(np.asarray([name])), batch_class=CTIMB)
+                              for name in all_ixs.indices}
+
+        # low-res render volumes: in-memory LRU on top of npy-files on disk
+        self.render_volumes = LruCache(RENDER_CACHE_BYTES)
+        os.makedirs(render_cache_path, exist_ok=True)
+
         # pipelines
         # load and resize scan to low res for render
         self.ppl_render_scan = (Pipeline()
@@ -38,11 +58,22 @@ class CtController:
 
         # note that this pipeline puts predictions in masks-component
         self.ppl_predict_scan = (Pipeline()
-                                    .load(fmt='blosc', components=['images', 'masks', 'spacing', 'origin'])
-                                    .fetch_nodules_info(nodules_df))
+                                    .load(fmt='blosc', components=['images', 'masks', 'spacing', 'origin']))
+
+        # per-scan shape, spacing, origin and nodules, computed once and persisted
+        self.ppl_scan_meta = (Pipeline()
+                                .load(fmt='blosc', components=['images', 'spacing', 'origin']))
+        self.scan_index = CtScanIndex(all_ixs.indices, self.load_scan_meta, nodules_df, scan_index_path)
+
+        # patch-wise inference in worker processes; running jobs by (sid, scan id)
+        # workers are spawned, as forking the server would copy its eventlet hub, threads and locks
+        executor = ProcessPoolExecutor(N_WORKERS, mp_context=multiprocessing.get_context('spawn'))
+        self.tiled_inference = TiledInference(predict_mask_patch, STRIDES, executor)
+        self.inference_jobs = {}
+        self.jobs_lock = threading.Lock()
 
     def build_item_ds(self, data):
-        """ Auxilliary method for building dataset from one elem.
+        """ Auxilliary method for getting dataset from one elem.
 
         Args:
             data: dict that contains id of scan (by key 'id') that is wrapped up in a
@@ -51,12 +82,53 @@ class CtController:
         Return:
             dataset containing one element.
         """
-        # build index
-        item_id = data.get('id')
-        ix_arr = np.asarray([self.ct_names.get(item_id)])
-        ix = all_ixs.create_subset(ix_arr)
+        name = self.ct_names.get(data.get('id'))
+        if name is None:
+            raise ValueError('Invalid ct id')
+        return self.item_datasets[name]
 
-        return Dataset(index=ix, batch_class=CTIMB)
+    def load_scan_meta(self, name):
+        """ Load shape, spacing and origin of a scan for the scan index.
+        """
+        bch = (self.item_datasets[name] >> self.ppl_scan_meta).next_batch(1)
+        return bch.images.shape, bch.spacing[0], bch.origin[0]
+
+    def get_render_volume(self, data):
+        """ Get low-res scan for rendering from the cache or compute and cache it.
+
+        Args:
+            data: dict that contains id of scan (by key 'id').
+
+        Return:
+            render volume of RENDER_SHAPE.
+        """
+        item_id = data.get('id')
+        if item_id not in self.ct_names:
+            raise ValueError('Invalid ct id')
+        volume = self.render_volumes.get(item_id)
+        if volume is not None:
+            return volume
+
+        path = os.path.join(render_cache_path, '{}.npy'.format(self.ct_names[item_id]))
+        if os.path.isfile(path):
+            volume = np.load(path)
+        else:
+            item_ds = self.build_item_ds(data)
+            bch = (item_ds >> self.ppl_render_scan).next_batch(1)
+            volume = bch.images.astype(np.float32)
+
+            # spill to disk, so that the volume survives eviction and restarts
+            # a unique temporary name, as concurrent requests of the same scan may render it at the same time
+            fd, tmp_path = tempfile.mkstemp(suffix='.tmp', dir=render_cache_path)
+            try:
+                with os.fdopen(fd, 'wb') as f:
+                    np.save(f, volume)
+                os.replace(tmp_path, path)
+            except BaseException:
+                os.remove(tmp_path)
+                raise
+        self.render_volumes.put(item_id, volume)
+        return volume
 
     def get_list(self, data, meta):
         """ Correspondence between ids and frontend names.
@@ -71,36 +143,89 @@ class CtController:
             data: dict containing key 'id' with id of the scan for rendering.
             meta: additional info needed for communication between frontend and backend.
 
-        NOTE: image, mask, nodules
+        NOTE: image, mask, nodules. With data['format'] == 'uint8' the image is quantized
+        over its range of values, which is sent along as 'window'.
         """
-        item_ds = self.build_item_ds(data)
-        bch = (item_ds >> self.ppl_render_scan).next_batch(1)
-        item_data = dict(image=bch.images.tolist())
-        print(bch.images.dtype)
+        volume = self.get_render_volume(data)
+        shape, spacing, _ = self.scan_index.get_meta(self.ct_names[data['id']])
+        item_data = dict(image=encode_array(volume, data.get('format')), shape=shape.tolist(),
+                         spacing=spacing.tolist())
 
         # update and fetch the data-dict along with meta
         return dict(data={**item_data, **data}, meta=meta)
 
-    def get_inference(self, data, meta):
+    def start_job(self, key):
+        """ Register an inference job, cancelling the running one with the same key.
+        """
+        cancel_event = threading.Event()
+        with self.jobs_lock:
+            previous_event = self.inference_jobs.get(key)
+            if previous_event is not None:
+                previous_event.set()
+            self.inference_jobs[key] = cancel_event
+        return cancel_event
+
+    def finish_job(self, key, cancel_event):
+        with self.jobs_lock:
+            if self.inference_jobs.get(key) is cancel_event:
+                del self.inference_jobs[key]
+
+    def cancel_inference(self, data, meta, sid=None):
+        """ Cancel running inference of the scan with id data['id'] requested by the client sid.
+        """
+        with self.jobs_lock:
+            cancel_event = self.inference_jobs.pop((sid, data.get('id')), None)
+        if cancel_event is not None:
+            cancel_event.set()
+
+    def cancel_client_inference(self, sid):
+        """ Cancel all running inference jobs of the client sid.
+        """
+        with self.jobs_lock:
+            keys = [key for key in self.inference_jobs if key[0] == sid]
+            cancel_events = [self.inference_jobs.pop(key) for key in keys]
+        for cancel_event in cancel_events:
+            cancel_event.set()
+
+    def get_inference(self, data, meta, sid=None, progress=None):
         """ Get predicted mask resized to low-res for rendering along with nodules-list.
 
         Args:
             data: dict containing key 'id' with 'id' of the scan for inference.
             meta: additional info needed for communication between frontend and backend.
-        """
-        item_ds = self.build_item_ds(data)
-        bch = (item_ds >> self.ppl_predict_scan).next_batch(1)
+            sid: id of the client. A repeated request of the same client for the same scan
+                cancels the previous one.
+            progress: callable that takes a payload with a partial low-res mask.
 
-        bch.images = bch.masks * 255
+        NOTE: the scan is processed patch by patch of STRIDES shape in N_WORKERS processes.
+        """
+        item_id = data.get('id')
+        if item_id not in self.ct_names:
+            raise ValueError('Invalid ct id')
+        key = (sid, item_id)
+        cancel_event = self.start_job(key)
+        try:
+            item_ds = self.build_item_ds(data)
+            bch = (item_ds >> self.ppl_predict_scan).next_batch(1)
+            sampling_index = get_sampling_index(bch.masks.shape, RENDER_SHAPE)
+
+            def on_progress(n_done, n_total, mask):
+                partial_mask = encode_array(mask[sampling_index], data.get('format'), window=(0, 255))
+                progress(dict(data=dict(id=item_id, done=n_done, total=n_total, mask=partial_mask), meta=meta))
+
+            on_progress = on_progress if progress is not None else None
+            mask = self.tiled_inference.run([bch.masks], on_progress, cancel_event=cancel_event)
+        finally:
+            self.finish_job(key, cancel_event)
+
+        bch.images = mask
         bch.masks = None
         bch.resize(shape=RENDER_SHAPE)
 
         # nodules info in pixel coords
-        nodules = (bch.nodules.nodule_center - bch.nodules.origin) / bch.nodules.spacing
-        diams = np.ceil(bch.nodules.nodule_size / bch.nodules.spacing)
-        nodules = np.rint(np.hstack([nodules, diams])).astype(np.int)
-        item_data = dict(mask=bch.images.tolist(), nodules=nodules.tolist())
+        nodules = self.scan_index.get_nodules(self.ct_names[item_id])
+        item_data = dict(mask=encode_array(bch.images, data.get('format'), window=(0, 255)),
+                         nodules=nodules.tolist())
         # update and fetch data dict
-        print('DONE PREDICTING')
         res = dict(data={**item_data, **data}, meta=meta)
         return res
@@ -0,0 +1,100 @@
+import os
+import hashlib
+
+import numpy as np
+
+
+class CtScanIndex:
+    """Per-scan metadata and nodules of CT scans, computed once and looked up by scan name.
+
+    Shapes, spacings and origins are stored as arrays with a row per scan. Nodules of all scans are stored in
+    a single array, sorted by scan, with per-scan offsets.
+
+    Args:
+        names: scan names, which are seriesuids of nodule annotations.
+        load_meta: callable, that takes a scan name and returns its shape, spacing and origin in zyx order.
+        nodules_df: DataFrame with nodule annotations in LUNA format.
+        cache_path: npz-file to persist the index to. The index is rebuilt if the file lists other scans. Nodules are
+            rebuilt if they were computed from other annotations, which is checked by a hash of ``nodules_df``.
+    """
+
+    META_ARRAYS = ("shapes", "spacings", "origins")
+    NODULE_ARRAYS = ("offsets", "centers", "diameters")
+    NODULE_COLUMNS = ["seriesuid", "coordZ", "coordY", "coordX", "diameter_mm"]
+
+    def __init__(self, names, load_meta, nodules_df, cache_path=None):
+        self.names = list(names)
+        self.positions = {name: i for i, name in enumerate(self.names)}
+        nodules_hash = self._hash_nodules(nodules_df)
+        arrays = self._load(cache_path) if cache_path is not None else {}
+        is_changed = False
+        if not arrays:
+            arrays.update(self._build_meta(load_meta))
+            is_changed = True
+        if arrays.get("nodules_hash") != nodules_hash:
+            arrays.update(self._build_nodules(nodules_df), nodules_hash=nodules_hash)
+            is_changed = True
+        if is_changed and cache_path is not None:
+            self._dump(cache_path, arrays)
+        for name in self.META_ARRAYS + self.NODULE_ARRAYS:
+            setattr(self, name, arrays[name])
+
+    def _build_meta(self, load_meta):
+        shapes, spacings, origins = zip(*(load_meta(name) for name in self.names)) if self.names else ([], [], [])
+        return {
+            "shapes": np.array(shapes, dtype=int).reshape(-1, 3),
+            "spacings": np.array(spacings, dtype=float).reshape(-1, 3),
+            "origins": np.array(origins, dtype=float).reshape(-1, 3),
+        }
+
+    def _build_nodules(self, nodules_df):
+        nodules_df = nodules_df[nodules_df["seriesuid"].isin(self.positions)]
+        scan_positions = nodules_df["seriesuid"].map(self.positions).values.astype(int)
+        order = np.argsort(scan_positions, kind="stable")
+        return {
+            "offsets": np.searchsorted(scan_positions[order], np.arange(len(self.names) + 1)),
+            "centers": nodules_df[["coordZ", "coordY", "coordX"]].values[order].astype(float),
+            "diameters": nodules_df["diameter_mm"].values[order].astype(float),
+        }
+
+    @classmethod
+    def _hash_nodules(cls, nodules_df):
+        return hashlib.sha256(nodules_df[cls.NODULE_COLUMNS].to_csv(index=False).encode()).hexdigest()
+
+    def _load(self, path):
+        """Load arrays of the index, dropping nodules if the file has no hash of their annotations."""
+        if not os.path.isfile(path):
+            return {}
+        with np.load(path) as index:
+            if index["names"].tolist() != self.names:
+                return {}
+            arrays = {name: index[name] for name in self.META_ARRAYS}
+            if "nodules_hash" in index.files:
+                arrays.update({name: index[name] for name in self.NODULE_ARRAYS})
+                arrays["nodules_hash"] = index["nodules_hash"].item()
+            return arrays
+
+    def _dump(self, path, arrays):
+        tmp_path = path + ".tmp.npz"
+        np.savez(tmp_path, names=np.array(self.names), **arrays)
+        os.replace(tmp_path, path)
+
+    def __contains__(self, name):
+        return name in self.positions
+
+    def get_meta(self, name):
+        position = self.positions[name]
+        return self.shapes[position], self.spacings[position], self.origins[position]
+
+    def get_nodules(self, name):
+        """Get nodules of a scan in pixel coordinates.
+
+        Return:
+            int array with a row per nodule: z, y, x of its center and its size along z, y, x.
+        """
+        position = self.positions[name]
+        start, stop = self.offsets[position], self.offsets[position + 1]
+        spacing = self.spacings[position]
+        centers = (self.centers[start:stop] - self.origins[position]) / spacing
+        sizes = np.ceil(self.diameters[start:stop, np.newaxis] / spacing)
+        return np.rint(np.hstack([centers, sizes])).astype(int)
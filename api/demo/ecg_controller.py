@@ -7,6 +7,10 @@ sys.path.insert(1, os.path.join(CURRENT_PATH, "ecg"))
 from cardio import dataset as ds
 from cardio import EcgDataset
 from cardio.pipelines import dirichlet_predict_pipeline, hmm_predict_pipeline
+from .batcher import MicroBatcher
+from .inference_cache import InferenceCache, hash_models
+from ..lru import LruCache
+from ..pyramid import SignalPyramid, parse_window
 os.environ["CUDA_VISIBLE_DEVICES"] = "-1"
 
 
@@ -16,6 +20,7 @@ class EcgController:
         ecg_names = [f for f in sorted(os.listdir(self.ecg_path)) if re.match(r"A.*\.hea", f)]
         key_len = len(str(len(ecg_names) + 1))
         self.ecg_names = {str(i + 1).zfill(key_len): f for i, f in enumerate(ecg_names)}
+        self.signals = LruCache(64 * 2**20, get_size=lambda item: item[0].nbytes)
 
         BATCH_SIZE = 1
 
@@ -32,40 +37,91 @@ class EcgController:
         hmm_path = os.path.join(CURRENT_PATH, "data", "ecg_models", "hmm", "hmm_model_old.dill")
         self.ppl_predict_states = hmm_predict_pipeline(hmm_path, batch_size=BATCH_SIZE)
 
-    def build_ds(self, data):
+        cache_dir = os.path.join(CURRENT_PATH, "data", "ecg_inference_cache")
+        self.inference_cache = InferenceCache(cache_dir, hash_models([dirichlet_path, hmm_path]))
+        self.inference_batcher = MicroBatcher(self.compute_inference, window=0.05, max_batch_size=16)
+
+    def get_ecg_name(self, data):
         ecg_id = data.get("id")
         ecg_name = self.ecg_names.get(ecg_id)
         if ecg_id is None or ecg_name is None:
             raise ValueError("Invalid ecg name")
-        eds = EcgDataset(path=os.path.join(self.ecg_path, ecg_name), no_ext=True, sort=True)
+        return ecg_name
+
+    def build_ds(self, ecg_names):
+        paths = [os.path.join(self.ecg_path, ecg_name) for ecg_name in ecg_names]
+        eds = EcgDataset(path=paths, no_ext=True, sort=True)
         return eds
 
     def get_list(self, data, meta):
         ecg_list = [dict(id=k, name=self.ecg_names[k].split(".")[0]) for k in sorted(self.ecg_names)]
         return dict(data=ecg_list, meta=meta)
 
+    def load_signal(self, data):
+        item = self.signals.get(data.get("id"))
+        if item is None:
+            eds = self.build_ds([self.get_ecg_name(data)])
+            batch = (eds >> self.ppl_load_signal).next_batch()
+            item = (SignalPyramid(batch.signal[0].ravel()), batch.meta[0]["fs"], batch.meta[0]["units"][0])
+            self.signals.put(data["id"], item)
+        return item
+
     def get_item_data(self, data, meta):
-        eds = self.build_ds(data)
-        batch = (eds >> self.ppl_load_signal).next_batch()
-        data["signal"] = batch.signal[0].ravel().tolist()
-        data["frequency"] = batch.meta[0]["fs"]
-        data["units"] = batch.meta[0]["units"][0]
+        pyramid, data["frequency"], data["units"] = self.load_signal(data)
+        data["signal"] = pyramid.get_signal(data.get("format"))
+        return dict(data=data, meta=meta)
+
+    def get_item_window(self, data, meta):
+        start, end, max_points = parse_window(data)
+        pyramid, data["frequency"], data["units"] = self.load_signal(data)
+        data["window"] = pyramid.get_window(start, end, max_points, data.get("format"))
         return dict(data=data, meta=meta)
 
     def get_inference(self, data, meta):
-        eds = self.build_ds(data)
-        batch = (eds >> self.ppl_predict_states).next_batch()
-        signal_meta = batch.meta[0]
-        inference = {
-            "heart_rate": signal_meta["hr"],
-            "qrs_interval": signal_meta["qrs"],
-            "qt_interval": signal_meta["qt"],
-            "pq_interval": signal_meta["pq"],
-            "p_segments": signal_meta["p_segments"].tolist(),
-            "t_segments": signal_meta["t_segments"].tolist(),
-            "qrs_segments": signal_meta["qrs_segments"].tolist(),
-        }
-        ppl_predict_af = (eds >> self.ppl_predict_af).run()
-        inference["af_prob"] = float(ppl_predict_af.get_variable("predictions_list")[0]["target_pred"]["A"])
+        ecg_name = self.get_ecg_name(data)
+        inference = self.inference_cache.get(ecg_name)
+        if inference is None:
+            inference = self.inference_batcher.submit(ecg_name).result()
         data["inference"] = inference
         return dict(data=data, meta=meta)
+
+    def compute_inference(self, ecg_names):
+        """Run HMM and Dirichlet inference for several ECGs at once and cache the results.
+
+        Args:
+            ecg_names: a list of ECG file names.
+
+        Return:
+            a dict of inference results by ECG file name.
+        """
+        batch_size = len(ecg_names)
+        eds = self.build_ds(ecg_names)
+        index_names = {ecg_name.split(".")[0]: ecg_name for ecg_name in ecg_names}
+        run_args = dict(shuffle=False, drop_last=False, n_epochs=1)
+        batch = (eds >> self.ppl_predict_states).next_batch(batch_size, **run_args)
+        ppl_predict_af = (eds >> self.ppl_predict_af).run(batch_size, **run_args)
+        predictions = ppl_predict_af.get_variable("predictions_list")
+        af_probs = {index: float(prediction["target_pred"]["A"])
+                    for index, prediction in zip(eds.indices, predictions)}
+        results = {}
+        for index, signal_meta in zip(batch.indices, batch.meta):
+            inference = {
+                "heart_rate": signal_meta["hr"],
+                "qrs_interval": signal_meta["qrs"],
+                "qt_interval": signal_meta["qt"],
+                "pq_interval": signal_meta["pq"],
+                "p_segments": signal_meta["p_segments"].tolist(),
+                "t_segments": signal_meta["t_segments"].tolist(),
+                "qrs_segments": signal_meta["qrs_segments"].tolist(),
+                "af_prob": af_probs[index],
+            }
+            ecg_name = index_names[index]
+            self.inference_cache.put(ecg_name, inference)
+            results[ecg_name] = inference
+        return results
+
+    def precompute(self):
+        ecg_names = [ecg_name for ecg_name in self.ecg_names.values() if self.inference_cache.get(ecg_name) is None]
+        futures = [self.inference_batcher.submit(ecg_name) for ecg_name in ecg_names]
+        for future in futures:
+            future.result()
@@ -0,0 +1,72 @@
+import os
+import json
+import hashlib
+import logging
+import threading
+
+from ..codec import to_builtin
+
+
+def hash_models(paths):
+    """Compute a joint sha256 of model files. Directories are hashed recursively in a fixed order."""
+    sha256 = hashlib.sha256()
+    for path in paths:
+        if os.path.isdir(path):
+            file_paths = sorted(os.path.join(root, f) for root, _, files in os.walk(path) for f in files)
+        else:
+            file_paths = [path]
+        for file_path in file_paths:
+            sha256.update(os.path.relpath(file_path, path).encode("utf-8"))
+            with open(file_path, "rb") as f:
+                for block in iter(lambda: f.read(65536), b""):
+                    sha256.update(block)
+    return sha256.hexdigest()
+
+
+class InferenceCache:
+    """In-memory and on-disk cache of inference results, keyed by record name and model hash.
+
+    Each result is stored as a separate json file, so results of different model versions never mix.
+
+    Args:
+        cache_dir: a directory to persist results to.
+        model_hash: a hash of the models, that produce cached results.
+    """
+
+    def __init__(self, cache_dir, model_hash):
+        self.cache_dir = cache_dir
+        self.model_hash = model_hash
+        self.logger = logging.getLogger("server." + __name__)
+        self.results = {}
+        self.lock = threading.Lock()
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def _get_path(self, name):
+        return os.path.join(self.cache_dir, "{}-{}.json".format(name, self.model_hash[:16]))
+
+    def get(self, name):
+        with self.lock:
+            result = self.results.get(name)
+        if result is not None:
+            return result
+        path = self._get_path(name)
+        if not os.path.isfile(path):
+            return None
+        try:
+            with open(path, encoding="utf-8") as f:
+                result = json.load(f)
+        except ValueError:
+            self.logger.warning("Cached inference {} is corrupted and will be recomputed".format(path))
+            return None
+        with self.lock:
+            self.results[name] = result
+        return result
+
+    def put(self, name, result):
+        path = self._get_path(name)
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(result, f, default=to_builtin)
+        os.replace(tmp_path, path)
+        with self.lock:
+            self.results[name] = result
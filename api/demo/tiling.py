@@ -0,0 +1,87 @@
+import itertools
+from concurrent.futures import FIRST_COMPLETED, wait
+
+import numpy as np
+
+
+class InferenceCancelled(Exception):
+    pass
+
+
+def get_patch_slices(shape, patch_shape):
+    """Split a volume into a grid of non-overlapping patches. Patches at the far edges may be smaller."""
+    starts = [range(0, size, step) for size, step in zip(shape, patch_shape)]
+    return [tuple(slice(start, start + step) for start, step in zip(origin, patch_shape))
+            for origin in itertools.product(*starts)]
+
+
+def get_sampling_index(shape, target_shape):
+    """Get an index, that samples a volume of ``shape`` down to ``target_shape`` by the nearest voxels."""
+    axes = [np.minimum(((np.arange(n) + 0.5) * size / n).astype(int), size - 1) for size, n in zip(shape, target_shape)]
+    return np.ix_(*axes)
+
+
+class TiledInference:
+    """Patch-wise inference over a volume, run in an executor.
+
+    Args:
+        predict_patch: picklable callable, that takes patches of all input volumes and returns a patch of
+            predictions of the same shape.
+        patch_shape: shape of patches.
+        executor: ``concurrent.futures`` executor to run ``predict_patch`` in.
+    """
+
+    POLL_INTERVAL = 0.1
+
+    def __init__(self, predict_patch, patch_shape, executor):
+        self.predict_patch = predict_patch
+        self.patch_shape = patch_shape
+        self.executor = executor
+
+    def run(self, inputs, on_progress=None, n_updates=10, cancel_event=None):
+        """Predict a volume patch by patch.
+
+        Args:
+            inputs: a list of volumes of the same shape.
+            on_progress: callable, that takes the number of finished patches, the total number of patches and
+                a partially filled prediction. It is called about ``n_updates`` times before the prediction is ready.
+            n_updates: number of progress updates.
+            cancel_event: ``threading.Event``, that cancels the inference once set.
+
+        Return:
+            predicted volume.
+
+        Raises:
+            InferenceCancelled: if ``cancel_event`` was set before all patches were predicted.
+        """
+        shape = inputs[0].shape
+        prediction = np.zeros(shape, dtype=np.float32)
+        patch_slices = get_patch_slices(shape, self.patch_shape)
+        n_total = len(patch_slices)
+        update_every = max(1, n_total // n_updates)
+        futures = {self.executor.submit(self.predict_patch, *[volume[s] for volume in inputs]): s
+                   for s in patch_slices}
+        pending = set(futures)
+        n_done = 0
+        try:
+            while pending:
+                done, pending = wait(pending, timeout=self.POLL_INTERVAL, return_when=FIRST_COMPLETED)
+                if cancel_event is not None and cancel_event.is_set():
+                    raise InferenceCancelled("Inference cancelled")
+                for future in done:
+                    prediction[futures[future]] = future.result()
+                    n_done += 1
+                    if on_progress is not None and n_done < n_total and n_done % update_every == 0:
+                        on_progress(n_done, n_total, prediction)
+        finally:
+            for future in pending:
+                future.cancel()
+        return prediction
+
+
+def predict_mask_patch(masks):
+    """Stand-in for a segmentation model: demo scans come with precomputed nodule masks.
+
+    Defined here rather than in ``ct_controller`` so that worker processes do not import the CT pipelines.
+    """
+    return masks * 255
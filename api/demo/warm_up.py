@@ -0,0 +1,64 @@
+import logging
+import threading
+from functools import partial
+
+
+class LazyController:
+    """Controller, that is constructed in the background by ``warm_up``.
+
+    Args:
+        name: controller name for status reports.
+        factory: callable, that constructs the controller.
+    """
+
+    def __init__(self, name, factory):
+        self.name = name
+        self.factory = factory
+        self.logger = logging.getLogger("server." + __name__)
+        self.controller = None
+        self.error = None
+        self.ready = threading.Event()
+
+    @property
+    def status(self):
+        if not self.ready.is_set():
+            return "warming up"
+        return "failed" if self.error is not None else "ready"
+
+    def build(self):
+        self.logger.info("Warming up {} controller".format(self.name))
+        try:
+            self.controller = self.factory()
+        except Exception as error:
+            self.error = error
+            self.logger.exception(error)
+        else:
+            self.logger.info("{} controller is ready".format(self.name))
+        finally:
+            self.ready.set()
+
+    def get(self):
+        if not self.ready.is_set():
+            raise RuntimeError("{} is warming up, try again later".format(self.name))
+        if self.error is not None:
+            raise RuntimeError("{} failed to start: {}".format(self.name, self.error))
+        return self.controller
+
+    def _call(self, method_name, data, meta, **kwargs):
+        return getattr(self.get(), method_name)(data, meta, **kwargs)
+
+    def method(self, method_name, **kwargs):
+        """Get a handler, that calls a controller method once the controller is ready."""
+        return partial(self._call, method_name, **kwargs)
+
+
+def warm_up(controllers, on_ready=None):
+    """Construct controllers one by one in a background thread, calling ``on_ready`` after each one."""
+    def run():
+        for controller in controllers:
+            controller.build()
+            if on_ready is not None:
+                on_ready()
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    return thread
@@ -0,0 +1,60 @@
+import threading
+from collections import OrderedDict
+
+
+def _get_nbytes(value):
+    return value.nbytes
+
+
+class LruCache:
+    """Thread-safe LRU cache, bounded by the total size of stored values in bytes.
+
+    Args:
+        max_bytes: maximum total size of stored values.
+        get_size: callable, that returns the size of a value in bytes. Defaults to the ``nbytes`` attribute.
+    """
+
+    def __init__(self, max_bytes, get_size=_get_nbytes):
+        self.max_bytes = max_bytes
+        self.get_size = get_size
+        self.n_bytes = 0
+        self.items = OrderedDict()
+        self.lock = threading.Lock()
+
+    def __contains__(self, key):
+        with self.lock:
+            return key in self.items
+
+    def __len__(self):
+        with self.lock:
+            return len(self.items)
+
+    def get(self, key, default=None):
+        with self.lock:
+            if key not in self.items:
+                return default
+            self.items.move_to_end(key)
+            return self.items[key][0]
+
+    def put(self, key, value):
+        size = self.get_size(value)
+        with self.lock:
+            self._pop(key)
+            if size > self.max_bytes:
+                return
+            self.items[key] = (value, size)
+            self.n_bytes += size
+            while self.n_bytes > self.max_bytes:
+                _, (_, evicted_size) = self.items.popitem(last=False)
+                self.n_bytes -= evicted_size
+
+    def pop(self, key, default=None):
+        with self.lock:
+            return self._pop(key, default)
+
+    def _pop(self, key, default=None):
+        item = self.items.pop(key, None)
+        if item is None:
+            return default
+        self.n_bytes -= item[1]
+        return item[0]
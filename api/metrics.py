@@ -0,0 +1,107 @@
+import threading
+from bisect import bisect_left
+from collections import defaultdict
+
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+SIZE_BUCKETS = tuple(2**i for i in range(10, 28, 2))
+
+
+def get_payload_size(value):
+    """Estimate the size of a value serialized to json in bytes. Binary buffers are counted as is."""
+    if isinstance(value, (bytes, bytearray)):
+        return len(value)
+    if isinstance(value, str):
+        return len(value) + 2
+    if isinstance(value, dict):
+        return 2 + sum(get_payload_size(key) + get_payload_size(item) + 2 for key, item in value.items())
+    if isinstance(value, (list, tuple)):
+        return 2 + sum(get_payload_size(item) + 1 for item in value)
+    return len(str(value))
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def get_quantile(self, q):
+        """Estimate a quantile by the upper bound of the bucket it falls into."""
+        rank = q * self.count
+        n_observed = 0
+        for bound, count in zip(self.buckets, self.counts):
+            n_observed += count
+            if n_observed >= rank and n_observed > 0:
+                return bound
+        return float("inf") if self.count else 0
+
+    def to_dict(self):
+        return {
+            "count": self.count,
+            "sum": self.sum,
+            "p50": self.get_quantile(0.5),
+            "p99": self.get_quantile(0.99),
+            "buckets": dict(zip([str(bound) for bound in self.buckets] + ["+Inf"], self.counts)),
+        }
+
+
+class MetricsRegistry:
+    """Thread-safe registry of counters and histograms. Each metric is broken down by a single label, which is
+    usually an event name.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = defaultdict(lambda: defaultdict(int))
+        self.histograms = defaultdict(dict)
+
+    def increment(self, name, label, value=1):
+        with self.lock:
+            self.counters[name][label] += value
+
+    def get_count(self, name, label):
+        with self.lock:
+            return self.counters[name][label]
+
+    def observe(self, name, label, value, buckets=LATENCY_BUCKETS):
+        with self.lock:
+            histogram = self.histograms[name].get(label)
+            if histogram is None:
+                histogram = self.histograms[name][label] = Histogram(buckets)
+            histogram.observe(value)
+
+    def snapshot(self):
+        with self.lock:
+            counters = {name: dict(labels) for name, labels in self.counters.items()}
+            histograms = {name: {label: histogram.to_dict() for label, histogram in labels.items()}
+                          for name, labels in self.histograms.items()}
+        return {"counters": counters, "histograms": histograms}
+
+    def render_text(self):
+        """Render metrics in the Prometheus text exposition format."""
+        snapshot = self.snapshot()
+        lines = []
+        for name, labels in sorted(snapshot["counters"].items()):
+            lines.append("# TYPE {} counter".format(name))
+            for label, value in sorted(labels.items()):
+                lines.append('{}{{label="{}"}} {}'.format(name, label, value))
+        for name, labels in sorted(snapshot["histograms"].items()):
+            lines.append("# TYPE {} histogram".format(name))
+            for label, histogram in sorted(labels.items()):
+                n_observed = 0
+                for bound, count in histogram["buckets"].items():
+                    n_observed += count
+                    lines.append('{}_bucket{{label="{}",le="{}"}} {}'.format(name, label, bound, n_observed))
+                lines.append('{}_sum{{label="{}"}} {}'.format(name, label, histogram["sum"]))
+                lines.append('{}_count{{label="{}"}} {}'.format(name, label, histogram["count"]))
+        return "\n".join(lines) + "\n"
+
+
+metrics = MetricsRegistry()
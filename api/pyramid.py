@@ -0,0 +1,102 @@
+import numpy as np
+
+from .codec import encode_scaled
+
+
+def _decimate(mins, maxs, factor):
+    n_bins = -(-mins.shape[-1] // factor)
+    pad_width = [(0, 0)] * (mins.ndim - 1) + [(0, n_bins * factor - mins.shape[-1])]
+    mins = np.pad(mins, pad_width, mode="edge").reshape(mins.shape[:-1] + (n_bins, factor)).min(axis=-1)
+    maxs = np.pad(maxs, pad_width, mode="edge").reshape(maxs.shape[:-1] + (n_bins, factor)).max(axis=-1)
+    return mins, maxs
+
+
+def _get_bin_range(start, end, bin_size):
+    return start // bin_size, -(-end // bin_size)
+
+
+class SignalPyramid:
+    """Min/max decimation pyramid of a signal.
+
+    Level ``k`` stores minimum and maximum values of the signal over consecutive bins of ``factor**k`` samples along
+    the last axis. Levels are built until the number of bins gets below ``min_bins``.
+
+    The signal and the levels keep the dtype of the signal, e.g. int16 ADC counts. They are multiplied by ``gain``
+    only when they are encoded.
+
+    Args:
+        signal: array with samples along the last axis.
+        factor: ratio of bin sizes of consecutive levels.
+        min_bins: number of bins, below which no more levels are built.
+        gain: per-lead multipliers to physical units for a signal with leads along the first axis, a single
+            multiplier or None if the signal is already in physical units.
+    """
+
+    def __init__(self, signal, factor=4, min_bins=256, gain=None):
+        self.signal = signal
+        self.gain = None if gain is None else np.reshape(gain, np.shape(gain) + (1,) * (signal.ndim - 1))
+        self.levels = []
+        mins = maxs = signal
+        bin_size = 1
+        while mins.shape[-1] > min_bins:
+            mins, maxs = _decimate(mins, maxs, factor)
+            bin_size *= factor
+            self.levels.append((bin_size, mins, maxs))
+
+    @property
+    def nbytes(self):
+        return self.signal.nbytes + sum(mins.nbytes + maxs.nbytes for _, mins, maxs in self.levels)
+
+    def get_signal(self, fmt=None):
+        """Get the whole signal in physical units, encoded in ``fmt``, see ``encode_array``."""
+        return encode_scaled(self.signal, self.gain, fmt)
+
+    def get_window(self, start, end, max_points, fmt=None):
+        """Get a part of the signal, decimated so that it has no more than ``max_points`` points.
+
+        Args:
+            start: index of the first sample of the window.
+            end: index of the sample following the last sample of the window.
+            max_points: maximum number of points to return. Each bin of a decimated level counts as two points.
+            fmt: array format, see ``encode_array``.
+
+        Return:
+            a dict with the actual window bounds and the bin size. If the bin size is 1, the "signal" key holds raw
+            samples, otherwise "min" and "max" keys hold per-bin extremes.
+        """
+        length = self.signal.shape[-1]
+        start = min(max(0, start), length)
+        end = min(max(start, end), length)
+        if end - start <= max_points or not self.levels:
+            return {"start": start, "end": end, "bin_size": 1,
+                    "signal": encode_scaled(self.signal[..., start:end], self.gain, fmt)}
+        for bin_size, mins, maxs in self.levels:
+            first_bin, last_bin = _get_bin_range(start, end, bin_size)
+            if 2 * (last_bin - first_bin) <= max_points:
+                mins, maxs = mins[..., first_bin:last_bin], maxs[..., first_bin:last_bin]
+                break
+        else:
+            # even the coarsest level is too detailed, so it is decimated further for this window only
+            level_bin_size = bin_size
+            factor = -(-2 * (end - start) // (max_points * level_bin_size))
+            first_bin, last_bin = _get_bin_range(start, end, level_bin_size * factor)
+            while 2 * (last_bin - first_bin) > max_points:
+                factor += 1
+                first_bin, last_bin = _get_bin_range(start, end, level_bin_size * factor)
+            bin_size = level_bin_size * factor
+            level_slice = slice(first_bin * factor, last_bin * factor)
+            mins, maxs = _decimate(mins[..., level_slice], maxs[..., level_slice], factor)
+        return {"start": first_bin * bin_size, "end": min(last_bin * bin_size, length), "bin_size": bin_size,
+                "min": encode_scaled(mins, self.gain, fmt), "max": encode_scaled(maxs, self.gain, fmt)}
+
+
+def parse_window(data):
+    start = data.get("start")
+    end = data.get("end")
+    max_points = data.get("max_points")
+    for name, value in (("start", start), ("end", end), ("max_points", max_points)):
+        if not isinstance(value, int) or value < 0:
+            raise ValueError("Invalid {} {}".format(name, value))
+    if max_points < 2:
+        raise ValueError("Invalid max_points {}".format(max_points))
+    return start, end, max_points
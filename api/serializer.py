@@ -0,0 +1,102 @@
+import zlib
+from functools import partial
+
+import numpy as np
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+try:
+    import lz4.frame as lz4_frame
+except ImportError:
+    lz4_frame = None
+
+
+NDARRAY_EXT_TYPE = 1
+
+COMPRESSORS = {"zlib": partial(zlib.compress, level=1)}
+if lz4_frame is not None:
+    COMPRESSORS["lz4"] = lz4_frame.compress
+
+
+class JsonSerializer:
+    """Default serializer, that leaves payloads to Socket.IO, which sends them as json with binary attachments."""
+
+    name = "json"
+
+    def serialize(self, payload):
+        return payload
+
+
+class MsgpackSerializer:
+    """Serializer of payloads into msgpack.
+
+    NumPy arrays are packed as extension type 1, which holds a msgpack array of the dtype string, the shape and the
+    raw C-ordered buffer. NumPy scalars are packed as Python ones. Packed payloads larger than ``threshold`` bytes
+    are compressed.
+
+    A serialized payload is a dict with "codec", "compression" (None if the payload is not compressed), "payload"
+    (a binary attachment) and "meta" keys. "meta" is a copy of the payload meta, so that clients can match
+    responses to requests without unpacking them.
+
+    Args:
+        compression: "zlib", "lz4" (if lz4 is installed) or None not to compress payloads.
+        threshold: minimum size of a packed payload to compress in bytes.
+    """
+
+    name = "msgpack"
+
+    def __init__(self, compression=None, threshold=2**14):
+        if msgpack is None:
+            raise ImportError("msgpack is not installed")
+        if compression is not None and compression not in COMPRESSORS:
+            raise ValueError("Unknown compression {}".format(compression))
+        self.compression = compression
+        self.threshold = threshold
+
+    @staticmethod
+    def _pack_default(value):
+        if isinstance(value, np.ndarray):
+            array = np.ascontiguousarray(value)
+            data = msgpack.packb([array.dtype.str, list(array.shape), memoryview(array.reshape(-1)).cast("B")])
+            return msgpack.ExtType(NDARRAY_EXT_TYPE, data)
+        if isinstance(value, np.generic):
+            return value.item()
+        raise TypeError("Can not serialize an object of type {}".format(type(value).__name__))
+
+    def serialize(self, payload):
+        buffer = msgpack.packb(payload, default=self._pack_default, use_bin_type=True)
+        compression = None
+        if self.compression is not None and len(buffer) >= self.threshold:
+            buffer = COMPRESSORS[self.compression](buffer)
+            compression = self.compression
+        meta = payload.get("meta") if isinstance(payload, dict) else None
+        return {"codec": self.name, "compression": compression, "payload": buffer, "meta": meta}
+
+
+SERIALIZERS = {
+    "json": JsonSerializer,
+    "msgpack": MsgpackSerializer,
+}
+
+
+def create_serializer(name=None, compression=None):
+    """Create a serializer by its name.
+
+    Args:
+        name: "json" or None for the default serializer, "msgpack" for ``MsgpackSerializer``.
+        compression: compression of large payloads, supported by binary serializers only.
+
+    Return:
+        a serializer with a ``serialize`` method, that takes a payload and returns the value to emit.
+    """
+    if name is None or name == "json":
+        if compression is not None:
+            raise ValueError("json payloads can not be compressed")
+        return JsonSerializer()
+    serializer_class = SERIALIZERS.get(name)
+    if serializer_class is None:
+        raise ValueError("Unknown serializer {}".format(name))
+    return serializer_class(compression)
@@ -0,0 +1,62 @@
+import os
+import sys
+import json
+import platform
+import subprocess
+from datetime import datetime
+
+import numpy as np
+
+
+REPO_PATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def summarize(durations):
+    """Summarize durations in seconds."""
+    if not durations:
+        return {"count": 0}
+    durations = np.asarray(durations, dtype=float)
+    p50, p90, p99 = np.percentile(durations, [50, 90, 99])
+    return {
+        "count": len(durations),
+        "mean": float(durations.mean()),
+        "p50": float(p50),
+        "p90": float(p90),
+        "p99": float(p99),
+        "max": float(durations.max()),
+    }
+
+
+def get_peak_rss():
+    """Get peak resident memory of the process in bytes or None if it is not available on this platform."""
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak_rss if sys.platform == "darwin" else peak_rss * 1024
+
+
+def _get_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], cwd=REPO_PATH,
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def write_report(path, name, params, results):
+    report = {
+        "benchmark": name,
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "commit": _get_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "peak_rss_bytes": get_peak_rss(),
+        "params": params,
+        "results": results,
+    }
+    with open(path, "w", encoding="utf-8") as report_file:
+        json.dump(report, report_file, indent=2)
+    print("Report is written to {}".format(path))
+    return report
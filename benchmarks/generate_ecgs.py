@@ -0,0 +1,87 @@
+"""Generate synthetic 12-lead ECGs in Schiller XML format.
+
+Usage:
+    python -m benchmarks.generate_ecgs <watch_dir> -n 1000
+"""
+
+import os
+import argparse
+from datetime import datetime, timedelta
+from xml.etree import ElementTree
+
+import numpy as np
+
+
+LEADS = ("I", "II", "III", "aVR", "aVL", "aVF", "V1", "V2", "V3", "V4", "V5", "V6")
+START_TIME = datetime(2018, 1, 1, 8)
+
+
+def make_signal(rng, n_leads, n_samples, fs):
+    """Make a signal in uV with QRS-like spikes at a random heart rate, baseline wander and noise."""
+    t = np.arange(n_samples) / fs
+    rr_interval = 60 / rng.uniform(50, 110)
+    beats = np.arange(rng.uniform(0, rr_interval), t[-1], rr_interval)
+    qrs = np.exp(-((t[:, np.newaxis] - beats) / 0.012)**2).sum(axis=1)
+    wave = np.exp(-((t[:, np.newaxis] - beats - 0.25) / 0.05)**2).sum(axis=1)
+    amplitudes = rng.uniform(-1500, 1500, size=(n_leads, 1))
+    wander = 100 * np.sin(2 * np.pi * rng.uniform(0.1, 0.5) * t)
+    noise = rng.normal(0, 20, size=(n_leads, n_samples))
+    return np.rint(amplitudes * qrs + amplitudes / 4 * wave + wander + noise).astype(np.int16)
+
+
+def make_xml(signal, fs, timestamp):
+    root = ElementTree.Element("examdescript")
+    start = ElementTree.SubElement(root, "startdatetime")
+    ElementTree.SubElement(start, "date").text = timestamp.strftime("%Y%m%d")
+    ElementTree.SubElement(start, "time").text = timestamp.strftime("%H%M%S")
+    event = ElementTree.SubElement(ElementTree.SubElement(root, "eventdata"), "event")
+    ElementTree.SubElement(event, "date").text = timestamp.strftime("%Y%m%d")
+    ElementTree.SubElement(event, "time").text = timestamp.strftime("%H%M%S")
+    wavedata = ElementTree.SubElement(event, "wavedata")
+    ElementTree.SubElement(wavedata, "type").text = "ECG_RHYTHMS"
+    ElementTree.SubElement(wavedata, "samplerate").text = str(fs)
+    ElementTree.SubElement(wavedata, "units").text = "uV"
+    for name, lead in zip(LEADS, signal):
+        channel = ElementTree.SubElement(wavedata, "channel")
+        ElementTree.SubElement(channel, "name").text = name
+        ElementTree.SubElement(channel, "data").text = ",".join(map(str, lead.tolist()))
+    return ElementTree.tostring(root, encoding="ISO-8859-1")
+
+
+def generate(watch_dir, n_files, fs=500, duration=10, seed=0, prefix="synthetic"):
+    """Write ``n_files`` ECGs into ``watch_dir``.
+
+    Every file has a unique signal and a timestamp a minute later than the previous one. Files are written under a
+    temporary name and then renamed, as an ECG device would do.
+
+    Return:
+        a list of paths of written files.
+    """
+    os.makedirs(watch_dir, exist_ok=True)
+    rng = np.random.RandomState(seed)
+    paths = []
+    for i in range(n_files):
+        signal = make_signal(rng, len(LEADS), fs * duration, fs)
+        path = os.path.join(watch_dir, "{}_{}_{:06d}.xml".format(prefix, seed, i))
+        tmp_path = path + ".part"
+        with open(tmp_path, "wb") as xml_file:
+            xml_file.write(make_xml(signal, fs, START_TIME + timedelta(minutes=i)))
+        os.replace(tmp_path, path)
+        paths.append(path)
+    return paths
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate synthetic ECGs in Schiller XML format.")
+    parser.add_argument("watch_dir", help="A directory to write ECGs to")
+    parser.add_argument("-n", "--n-files", type=int, default=100, help="Number of ECGs")
+    parser.add_argument("--fs", type=int, default=500, help="Sampling rate in Hz")
+    parser.add_argument("--duration", type=int, default=10, help="Signal duration in seconds")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed")
+    args = parser.parse_args()
+    paths = generate(args.watch_dir, args.n_files, args.fs, args.duration, args.seed)
+    print("{} ECGs are written to {}".format(len(paths), args.watch_dir))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,224 @@
+"""Multi-client load test of a running server.
+
+Every client sends requests one after another, picking events at random according to the event mix of the launch
+mode, and measures the time until the response with its request id in meta arrives. Responses are broadcast to all
+clients, so the request id is what tells a client its own responses. "ERROR" events carry no meta, so a failed
+request is counted as a timeout, and errors are counted once, by the first client.
+
+With ``--serializer msgpack`` clients choose the binary serializer of the server at connect time, and serialized
+responses are decoded as a real client would do.
+
+Usage:
+    python server.py annotation
+    python -m benchmarks.load_test annotation --clients 8 --duration 60 --report load.json
+"""
+
+import zlib
+import time
+import random
+import argparse
+import threading
+from uuid import uuid4
+from collections import defaultdict
+from urllib.parse import urlencode
+
+import numpy as np
+import socketio
+
+from .common import summarize, write_report
+
+
+NAMESPACE = "/api"
+
+# (request event, response event, weight)
+EVENT_MIXES = {
+    "annotation": [
+        ("ECG_GET_LIST", "ECG_GOT_LIST", 2),
+        ("ECG_GET_ITEM_DATA", "ECG_GOT_ITEM_DATA", 5),
+        ("ECG_GET_ITEM_WINDOW", "ECG_GOT_ITEM_WINDOW", 3),
+        ("ECG_GET_COMMON_ANNOTATION_LIST", "ECG_GOT_COMMON_ANNOTATION_LIST", 1),
+    ],
+    "demo": [
+        ("ECG_GET_LIST", "ECG_GOT_LIST", 1),
+        ("ECG_GET_ITEM_DATA", "ECG_GOT_ITEM_DATA", 3),
+        ("ECG_GET_INFERENCE", "ECG_GOT_INFERENCE", 2),
+        ("CT_GET_LIST", "CT_GOT_LIST", 1),
+        ("CT_GET_ITEM_DATA", "CT_GOT_ITEM_DATA", 2),
+        ("CT_GET_INFERENCE", "CT_GOT_INFERENCE", 1),
+    ],
+}
+
+
+def _unpack_ext(code, data):
+    import msgpack
+    if code != 1:
+        return msgpack.ExtType(code, data)
+    dtype, shape, buffer = msgpack.unpackb(data)
+    return np.frombuffer(buffer, dtype=dtype).reshape(shape)
+
+
+def decode_payload(payload):
+    """Decode a payload of the server msgpack serializer, other payloads are returned as is."""
+    if not isinstance(payload, dict) or "codec" not in payload:
+        return payload
+    import msgpack
+    buffer = payload["payload"]
+    if payload["compression"] == "zlib":
+        buffer = zlib.decompress(buffer)
+    elif payload["compression"] == "lz4":
+        import lz4.frame
+        buffer = lz4.frame.decompress(buffer)
+    return msgpack.unpackb(buffer, ext_hook=_unpack_ext, raw=False)
+
+
+class Client:
+    def __init__(self, url, response_events, count_errors=False):
+        self.sio = socketio.Client(reconnection=False)
+        self.pending = {}
+        self.n_errors = 0
+        for event in set(response_events) | {"SERVER_METRICS"}:
+            self.sio.on(event, self._on_response, namespace=NAMESPACE)
+        if count_errors:
+            self.sio.on("ERROR", self._on_error, namespace=NAMESPACE)
+        self.sio.connect(url, namespaces=[NAMESPACE])
+
+    def _on_response(self, payload):
+        payload = decode_payload(payload)
+        meta = payload.get("meta") if isinstance(payload, dict) else None
+        request_id = meta.get("request_id") if isinstance(meta, dict) else None
+        waiter = self.pending.get(request_id)
+        if waiter is not None:
+            waiter[1] = payload
+            waiter[0].set()
+
+    def _on_error(self, message):
+        self.n_errors += 1
+
+    def request(self, event, data, timeout):
+        """Send an event and wait for the response. Return the response payload or None on timeout."""
+        request_id = uuid4().hex
+        waiter = [threading.Event(), None]
+        self.pending[request_id] = waiter
+        try:
+            self.sio.emit(event, (data, {"request_id": request_id}), namespace=NAMESPACE)
+            waiter[0].wait(timeout)
+        finally:
+            del self.pending[request_id]
+        return waiter[1]
+
+    def close(self):
+        self.sio.disconnect()
+
+
+def make_request_data(event, ids, rng, fmt):
+    if event in ("ECG_GET_ITEM_DATA", "ECG_GET_INFERENCE"):
+        data = {"id": rng.choice(ids["ECG"])}
+    elif event == "ECG_GET_ITEM_WINDOW":
+        start = rng.randrange(0, 4000)
+        data = {"id": rng.choice(ids["ECG"]), "start": start, "end": start + 1000, "max_points": 500}
+    elif event in ("CT_GET_ITEM_DATA", "CT_GET_INFERENCE"):
+        data = {"id": rng.choice(ids["CT"])}
+    else:
+        return {}
+    if fmt is not None:
+        data["format"] = fmt
+    return data
+
+
+def fetch_ids(client, mode, timeout):
+    ids = {}
+    kinds = ("ECG", "CT") if mode == "demo" else ("ECG",)
+    for kind in kinds:
+        response = client.request(kind + "_GET_LIST", {}, timeout)
+        if response is None:
+            raise RuntimeError("The server did not respond to {}_GET_LIST".format(kind))
+        ids[kind] = [item["id"] for item in response["data"]]
+        if not ids[kind]:
+            raise RuntimeError("The server has no {} items".format(kind))
+    return ids
+
+
+def run_client(client, mode, ids, deadline, timeout, fmt, seed, results):
+    rng = random.Random(seed)
+    events = EVENT_MIXES[mode]
+    weights = [weight for _, _, weight in events]
+    while time.perf_counter() < deadline:
+        event, _, _ = rng.choices(events, weights)[0]
+        data = make_request_data(event, ids, rng, fmt)
+        start = time.perf_counter()
+        response = client.request(event, data, timeout)
+        results.append((event, time.perf_counter() - start, response is not None))
+
+
+def get_url(url, serializer, compression):
+    query = {key: value for key, value in (("serializer", serializer), ("compression", compression))
+             if value is not None}
+    return url + "?" + urlencode(query) if query else url
+
+
+def run(url, mode, n_clients, duration, timeout, fmt, seed):
+    response_events = [event_out for _, event_out, _ in EVENT_MIXES[mode]]
+    start = time.perf_counter()
+    clients = [Client(url, response_events, count_errors=(i == 0)) for i in range(n_clients)]
+    connect_seconds = time.perf_counter() - start
+    try:
+        ids = fetch_ids(clients[0], mode, timeout)
+        results = []
+        deadline = time.perf_counter() + duration
+        threads = [threading.Thread(target=run_client,
+                                    args=(client, mode, ids, deadline, timeout, fmt, seed + i, results))
+                   for i, client in enumerate(clients)]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - start
+        server_metrics = clients[0].request("SERVER_METRICS", {}, timeout)
+        n_errors = clients[0].n_errors
+    finally:
+        for client in clients:
+            client.close()
+
+    durations = defaultdict(list)
+    timeouts = defaultdict(int)
+    for event, event_duration, ok in results:
+        if ok:
+            durations[event].append(event_duration)
+        else:
+            timeouts[event] += 1
+    n_ok = sum(len(event_durations) for event_durations in durations.values())
+    return {
+        "connect_seconds": connect_seconds,
+        "elapsed_seconds": elapsed,
+        "requests": len(results),
+        "throughput": n_ok / elapsed,
+        "errors": n_errors,
+        "timeouts": dict(timeouts),
+        "total": summarize([event_duration for event, event_duration, ok in results if ok]),
+        "events": {event: summarize(event_durations) for event, event_durations in durations.items()},
+        "server_metrics": server_metrics["data"] if server_metrics is not None else None,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Multi-client load test of a running server.")
+    parser.add_argument("mode", choices=sorted(EVENT_MIXES), help="Launch mode of the server")
+    parser.add_argument("--url", default="http://localhost:9090", help="Server url")
+    parser.add_argument("--clients", type=int, default=8, help="Number of concurrent clients")
+    parser.add_argument("--duration", type=float, default=30, help="Test duration in seconds")
+    parser.add_argument("--timeout", type=float, default=30, help="Response timeout in seconds")
+    parser.add_argument("--format", default=None,
+                        help="Array format to request, json by default or ndarray with a binary serializer")
+    parser.add_argument("--serializer", default=None, help="Serializer to choose at connect time, e.g. msgpack")
+    parser.add_argument("--compression", default=None, help="Compression of large payloads, e.g. zlib")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed")
+    parser.add_argument("--report", default="load_report.json", help="A path to write the json report to")
+    args = parser.parse_args()
+    url = get_url(args.url, args.serializer, args.compression)
+    results = run(url, args.mode, args.clients, args.duration, args.timeout, args.format, args.seed)
+    write_report(args.report, "load_test_" + args.mode, vars(args), results)
+
+
+if __name__ == "__main__":
+    main()
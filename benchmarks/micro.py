@@ -0,0 +1,166 @@
+"""Micro-benchmarks of the ECG annotation backend on synthetic ECGs.
+
+Measures ``loader.load_data``, handler startup, ``_get_ecg_list``, ``_set_annotation``, ``_write_annotation`` and
+the burst of ``on_created`` events, when many ECGs arrive into ``watch_dir`` at once.
+
+Usage:
+    python -m benchmarks.micro -n 500 --report micro.json
+"""
+
+import os
+import time
+import shutil
+import argparse
+import tempfile
+import threading
+
+from .common import REPO_PATH, summarize, write_report
+from .generate_ecgs import generate
+from api.annotation.handler import EcgDirectoryHandler
+from api.annotation.loader import load_data
+
+
+ANNOTATION_LIST_PATH = os.path.join(REPO_PATH, "api", "annotation", "annotation_list.json")
+
+
+class RecordingNamespace:
+    """Stand-in for ``AnnotationNamespace``, that records emitted events instead of sending them."""
+
+    def __init__(self):
+        self.events = []
+        self.condition = threading.Condition()
+
+    def emit(self, event, data=None, **kwargs):
+        with self.condition:
+            self.events.append((time.perf_counter(), event, data))
+            self.condition.notify_all()
+
+    def on_ECG_GET_COMMON_ANNOTATION_LIST(self, data, meta):
+        pass
+
+    def wait_for(self, event, count, timeout):
+        deadline = time.perf_counter() + timeout
+        with self.condition:
+            while sum(e == event for _, e, _ in self.events) < count:
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    return False
+                self.condition.wait(remaining)
+        return True
+
+
+def time_calls(func, repeat):
+    durations = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        durations.append(time.perf_counter() - start)
+    return durations
+
+
+def create_handler(work_dir, **handler_options):
+    return EcgDirectoryHandler(RecordingNamespace(), os.path.join(work_dir, "inbox"), os.path.join(work_dir, "dump"),
+                               ANNOTATION_LIST_PATH, os.path.join(work_dir, "annotation_count.json"),
+                               os.path.join(work_dir, "annotation.feather"), ignore_directories=True,
+                               **handler_options)
+
+
+def bench_load_data(paths, repeat):
+    return summarize([duration for path in paths for duration in time_calls(lambda: load_data(path), repeat)])
+
+
+def bench_get_ecg_list(handler, repeat):
+    queries = {
+        "full": {},
+        "page": {"offset": 0, "limit": 50},
+        "annotated": {"annotated": True},
+    }
+    return {name: summarize(time_calls(lambda: handler._get_ecg_list(dict(query), {}), repeat))
+            for name, query in queries.items()}
+
+
+def bench_set_annotation(handler, n_annotated):
+    label = next(iter(handler.annotation_count_dict))
+    records = list(handler.records)[:n_annotated]
+    return summarize([duration for record in records
+                      for duration in time_calls(lambda: handler._set_annotation({"id": record.sha,
+                                                                                  "annotation": [label]}, {}), 1)])
+
+
+def bench_write_annotation(handler, work_dir, repeat):
+    annotations = [(record.file_name, record.annotation) for record in handler.records if record.annotation]
+    path = os.path.join(work_dir, "annotation_export.feather")
+    return summarize(time_calls(lambda: handler._write_annotation(annotations, path), repeat))
+
+
+def bench_created_burst(handler, work_dir, n_files, timeout):
+    staging_dir = os.path.join(work_dir, "staging")
+    paths = generate(staging_dir, n_files, seed=1)
+    namespace = handler.namespace
+    n_added = sum(event == "ECG_LIST_ITEM_ADDED" for _, event, _ in namespace.events)
+    start = time.perf_counter()
+    for path in paths:
+        os.replace(path, os.path.join(handler.watch_dir, os.path.basename(path)))
+    finished = namespace.wait_for("ECG_LIST_ITEM_ADDED", n_added + n_files, timeout)
+    duration = time.perf_counter() - start
+    return {
+        "n_files": n_files,
+        "finished": finished,
+        "seconds": duration,
+        "files_per_second": n_files / duration,
+    }
+
+
+def run(work_dir, n_files, n_burst, n_annotated, repeat, handler_options, timeout):
+    inbox = os.path.join(work_dir, "inbox")
+    paths = generate(inbox, n_files)
+    results = {"load_data": bench_load_data(paths[:min(len(paths), 50)], repeat)}
+
+    start = time.perf_counter()
+    handler = create_handler(work_dir, **handler_options)
+    results["cold_startup_seconds"] = time.perf_counter() - start
+    try:
+        results["get_ecg_list"] = bench_get_ecg_list(handler, repeat)
+        results["set_annotation"] = bench_set_annotation(handler, min(n_annotated, n_files))
+        results["write_annotation"] = bench_write_annotation(handler, work_dir, repeat)
+        results["created_burst"] = bench_created_burst(handler, work_dir, n_burst, timeout)
+    finally:
+        handler.observer.stop()
+        handler.observer.join()
+
+    start = time.perf_counter()
+    handler = create_handler(work_dir, **handler_options)
+    results["warm_startup_seconds"] = time.perf_counter() - start
+    handler.observer.stop()
+    handler.observer.join()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Micro-benchmarks of the ECG annotation backend.")
+    parser.add_argument("-n", "--n-files", type=int, default=500, help="Number of ECGs in watch_dir")
+    parser.add_argument("--n-burst", type=int, default=100, help="Number of ECGs arriving at once")
+    parser.add_argument("--n-annotated", type=int, default=200, help="Number of ECGs to annotate and export")
+    parser.add_argument("--repeat", type=int, default=5, help="Number of repetitions of each measurement")
+    parser.add_argument("--n-workers", type=int, default=1, help="Number of processes to load ECGs with")
+    parser.add_argument("--cache", action="store_true", help="Use the on-disk signal cache")
+    parser.add_argument("--timeout", type=float, default=300, help="Timeout of the burst benchmark in seconds")
+    parser.add_argument("--work-dir", help="A directory for generated ECGs, a temporary one by default")
+    parser.add_argument("--report", default="micro_report.json", help="A path to write the json report to")
+    args = parser.parse_args()
+
+    work_dir = args.work_dir or tempfile.mkdtemp(prefix="ecg_bench_")
+    handler_options = {"n_workers": args.n_workers}
+    if args.cache:
+        handler_options["cache_dir"] = os.path.join(work_dir, "cache")
+    try:
+        results = run(work_dir, args.n_files, args.n_burst, args.n_annotated, args.repeat, handler_options,
+                      args.timeout)
+    finally:
+        if args.work_dir is None:
+            shutil.rmtree(work_dir, ignore_errors=True)
+    write_report(args.report, "micro", vars(args), results)
+
+
+if __name__ == "__main__":
+    main()
@@ -4,9 +4,11 @@ import logging
 import logging.config
 import argparse
 
-from flask import Flask
+from flask import Flask, Response, jsonify
 from flask_socketio import SocketIO
 
+from api.metrics import metrics
+
 
 def create_logger(logger_config_path):
     with open(logger_config_path, encoding="utf-8") as logger_config:
@@ -16,19 +18,32 @@ def create_logger(logger_config_path):
     return logger
 
 
-def get_config(path, required_keys):
+def get_config(path, required_keys, optional_keys=frozenset()):
     with open(path, encoding="utf-8") as server_config:
         server_config = json.load(server_config)
-    key_diff = set(server_config) - required_keys
+    key_diff = required_keys - set(server_config)
     if key_diff:
         raise KeyError("{} keys are not found in the server config".format(sorted(key_diff)))
+    key_diff = set(server_config) - required_keys - optional_keys
+    if key_diff:
+        raise KeyError("{} keys are not supported in the server config".format(sorted(key_diff)))
     return server_config
 
 
+def get_options(server_config, optional_keys):
+    return {key: server_config[key] for key in optional_keys if key in server_config}
+
+
 def parse_demo_args(args):
     REQUIRED_KEYS = {"logger_config"}
     server_config = get_config(args.config, REQUIRED_KEYS)
     logger = create_logger(server_config["logger_config"])
+    if args.precompute:
+        logger.info("Precomputing ECG inference")
+        from api.demo.ecg_controller import EcgController
+        EcgController().precompute()
+        logger.info("ECG inference precomputed")
+        return None, logger
     logger.info("Creating demo namespace")
     from api.demo.api import DemoNamespace as Namespace
     namespace = Namespace("/api")
@@ -45,13 +60,22 @@ def parse_annotation_args(args):
         "submitted_annotation_path",
         "logger_config",
     }
-    server_config = get_config(args.config, REQUIRED_KEYS)
+    OPTIONAL_KEYS = {
+        "cache_dir",
+        "n_workers",
+        "signal_cache_bytes",
+        "n_prefetch",
+        "ingest_window",
+        "database_path",
+    }
+    server_config = get_config(args.config, REQUIRED_KEYS, OPTIONAL_KEYS)
     logger = create_logger(server_config["logger_config"])
     logger.info("Creating annotation namespace")
     from api.annotation.api import AnnotationNamespace as Namespace
     namespace = Namespace(server_config["watch_dir"], server_config["dump_dir"],
                           server_config["annotation_list_path"], server_config["annotation_count_path"],
-                          server_config["submitted_annotation_path"], "/api")
+                          server_config["submitted_annotation_path"], "/api",
+                          handler_options=get_options(server_config, OPTIONAL_KEYS))
     logger.info("Namespace created")
     return namespace, logger
 
@@ -64,6 +88,8 @@ def parse_args():
     parser_demo = subparsers.add_parser("demo", help="Launch an ECG/CT demo")
     parser_demo.add_argument("-c", "--config", help="A path to a json file with server configuration",
                              default=os.path.join(".", "api", "demo", "server_config.json"))
+    parser_demo.add_argument("--precompute", action="store_true",
+                             help="Fill the inference cache for all demo ECGs and exit")
     parser_demo.set_defaults(parse=parse_demo_args)
 
     parser_annotation = subparsers.add_parser("annotation", help="Launch an ECG annotation tool")
@@ -71,19 +97,27 @@ def parse_args():
                                    default=os.path.join(".", "api", "annotation", "server_config.json"))
     parser_annotation.set_defaults(parse=parse_annotation_args)
 
+    for subparser in (parser_demo, parser_annotation):
+        subparser.add_argument("-p", "--port", type=int, default=9090, help="A port to listen on")
+
     args = parser.parse_args()
-    return args.parse(args)
+    namespace, logger = args.parse(args)
+    return namespace, logger, args.port
 
 
 def main():
-    namespace, logger = parse_args()
+    namespace, logger, port = parse_args()
+    if namespace is None:
+        return
 
     app = Flask(__name__)
     socketio = SocketIO(app)
     socketio.on_namespace(namespace)
+    app.add_url_rule("/status", "status", lambda: jsonify(namespace.get_status()))
+    app.add_url_rule("/metrics", "metrics", lambda: Response(metrics.render_text(), mimetype="text/plain"))
 
     logger.info("Server launched")
-    socketio.run(app, port=9090)
+    socketio.run(app, port=port)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,44 @@
+from api.annotation.change_feed import ChangeFeed
+
+
+def make_feed(n_changes, max_changes=10000):
+    feed = ChangeFeed(max_changes)
+    for i in range(n_changes):
+        feed.add("ECG_LIST_ITEM_ADDED", {"id": str(i)})
+    return feed
+
+
+def test_add_returns_change():
+    feed = ChangeFeed()
+    change = feed.add("ECG_LIST_ITEM_REMOVED", {"id": "a"})
+    assert change == {"revision": 1, "event": "ECG_LIST_ITEM_REMOVED", "data": {"id": "a"}}
+
+
+def test_get_since():
+    feed = make_feed(5)
+    assert [change["revision"] for change in feed.get_since(2, feed.epoch)] == [3, 4, 5]
+    assert [change["data"]["id"] for change in feed.get_since(0, feed.epoch)] == ["0", "1", "2", "3", "4"]
+
+
+def test_up_to_date():
+    feed = make_feed(5)
+    assert feed.get_since(5, feed.epoch) == []
+    empty_feed = ChangeFeed()
+    assert empty_feed.get_since(0, empty_feed.epoch) == []
+
+
+def test_other_epoch_resyncs():
+    feed = make_feed(5)
+    assert feed.get_since(2, make_feed(5).epoch) is None
+
+
+def test_future_revision_resyncs():
+    feed = make_feed(5)
+    assert feed.get_since(6, feed.epoch) is None
+
+
+def test_dropped_changes_resync():
+    feed = make_feed(10, max_changes=4)
+    assert feed.get_since(5, feed.epoch) is None
+    assert [change["revision"] for change in feed.get_since(6, feed.epoch)] == [7, 8, 9, 10]
+    assert feed.get_since(10, feed.epoch) == []
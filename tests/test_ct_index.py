@@ -0,0 +1,70 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from api.demo.ct_index import CtScanIndex
+
+
+@pytest.fixture
+def nodules_df():
+    return pd.DataFrame({"seriesuid": ["a", "b", "a", "c"], "coordX": [1., 2., 3., 4.], "coordY": [1., 2., 3., 4.],
+                         "coordZ": [1., 2., 3., 4.], "diameter_mm": [4., 5., 6., 7.]})
+
+
+class MetaLoader:
+    def __init__(self):
+        self.names = []
+
+    def __call__(self, name):
+        self.names.append(name)
+        return (10, 20, 30), (2., 1., 1.), (0., 0., 0.)
+
+
+def test_lookup(nodules_df):
+    index = CtScanIndex(["a", "b"], MetaLoader(), nodules_df)
+    shape, spacing, origin = index.get_meta("b")
+    assert shape.tolist() == [10, 20, 30]
+    assert index.get_nodules("a").tolist() == [[0, 1, 1, 2, 4, 4], [2, 3, 3, 3, 6, 6]]
+    assert index.get_nodules("b").tolist() == [[1, 2, 2, 3, 5, 5]]
+    assert "c" not in index
+
+
+def test_index_is_persisted(tmp_path, nodules_df):
+    path = str(tmp_path / "index.npz")
+    CtScanIndex(["a", "b"], MetaLoader(), nodules_df, path)
+    load_meta = MetaLoader()
+    index = CtScanIndex(["a", "b"], load_meta, nodules_df, path)
+    assert load_meta.names == []
+    assert len(index.get_nodules("a")) == 2
+
+
+def test_other_scans_rebuild_the_index(tmp_path, nodules_df):
+    path = str(tmp_path / "index.npz")
+    CtScanIndex(["a", "b"], MetaLoader(), nodules_df, path)
+    load_meta = MetaLoader()
+    index = CtScanIndex(["a", "c"], load_meta, nodules_df, path)
+    assert load_meta.names == ["a", "c"]
+    assert len(index.get_nodules("c")) == 1
+
+
+def test_edited_annotations_rebuild_nodules_only(tmp_path, nodules_df):
+    path = str(tmp_path / "index.npz")
+    CtScanIndex(["a", "b"], MetaLoader(), nodules_df, path)
+    nodules_df.loc[1, "diameter_mm"] = 9.
+    load_meta = MetaLoader()
+    index = CtScanIndex(["a", "b"], load_meta, nodules_df, path)
+    assert load_meta.names == []
+    assert index.get_nodules("b").tolist() == [[1, 2, 2, 5, 9, 9]]
+    assert CtScanIndex(["a", "b"], load_meta, nodules_df, path).get_nodules("b").tolist() == [[1, 2, 2, 5, 9, 9]]
+
+
+def test_index_without_annotations_hash_rebuilds_nodules(tmp_path, nodules_df):
+    path = str(tmp_path / "index.npz")
+    index = CtScanIndex(["a", "b"], MetaLoader(), nodules_df, path)
+    arrays = {name: getattr(index, name) for name in CtScanIndex.META_ARRAYS + CtScanIndex.NODULE_ARRAYS}
+    arrays["diameters"] = np.zeros_like(arrays["diameters"])
+    np.savez(path, names=np.array(["a", "b"]), **arrays)
+    load_meta = MetaLoader()
+    index = CtScanIndex(["a", "b"], load_meta, nodules_df, path)
+    assert load_meta.names == []
+    assert index.get_nodules("b").tolist() == [[1, 2, 2, 3, 5, 5]]
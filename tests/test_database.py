@@ -0,0 +1,99 @@
+from datetime import datetime
+
+import numpy as np
+import pytest
+
+from api.annotation.database import EcgDatabase
+from api.annotation.store import EcgRecord
+
+
+def make_record(sha, file_name=None, annotation=None):
+    return EcgRecord(sha, file_name or sha + ".xml", np.int64(100), np.float64(1.5), datetime(2018, 1, 1, 10),
+                     np.int64(500), ["mV"], ["I", "II"], annotation)
+
+
+@pytest.fixture
+def path(tmp_path):
+    return str(tmp_path / "ecg.sqlite")
+
+
+def test_put_and_get(path):
+    db = EcgDatabase(path)
+    assert db.created
+    db.put_records([make_record("a", annotation=["Норма"]), make_record("b")])
+    record = db.get_record("a")
+    assert (record.file_name, record.file_size, record.fs, record.annotation) == ("a.xml", 100, 500, ["Норма"])
+    assert record.timestamp == datetime(2018, 1, 1, 10)
+    assert [record.sha for record in db.get_records()] == ["a", "b"]
+    assert [record.sha for record in db.get_records(annotated=True)] == ["a"]
+    assert db.get_record("c") is None
+    assert not EcgDatabase(path).created
+
+
+def test_put_replaces_same_file_name(path):
+    db = EcgDatabase(path)
+    db.put_record(make_record("a", "x.xml"))
+    db.put_record(make_record("b", "x.xml"))
+    assert [record.sha for record in db.get_records()] == ["b"]
+
+
+def test_own_changes_are_skipped(path):
+    db = EcgDatabase(path)
+    revision = db.get_revision()
+    db.put_record(make_record("a"))
+    db.set_annotation("a", ["Норма"])
+    last_revision, shas = db.get_changes(revision)
+    assert last_revision == db.get_revision() > revision
+    assert shas == set()
+
+
+def test_changes_of_peers(path):
+    db, peer = EcgDatabase(path), EcgDatabase(path)
+    peer.put_record(make_record("a", "x.xml"))
+    revision = db.get_revision()
+    peer.put_record(make_record("b", "x.xml"))
+    peer.add_dumped_counts({"Норма": 1})
+    assert db.get_changes(revision) == (db.get_revision(), {"a", "b", None})
+
+
+def test_rename_and_remove_are_logged(path):
+    db, peer = EcgDatabase(path), EcgDatabase(path)
+    peer.put_records([make_record("a"), make_record("b")])
+    revision = db.get_revision()
+    peer.rename_record("a.xml", "c.xml")
+    peer.remove_record("b")
+    assert db.get_changes(revision)[1] == {"a", "b"}
+    assert db.get_record("a").file_name == "c.xml"
+    assert db.get_record("b") is None
+
+
+def test_no_changes(path):
+    db = EcgDatabase(path)
+    assert db.get_changes(db.get_revision()) == (db.get_revision(), set())
+
+
+def test_pruned_log_requires_reload(path):
+    db, peer = EcgDatabase(path), EcgDatabase(path)
+    peer.MAX_CHANGES = 2
+    revision = db.get_revision()
+    for sha in "abcd":
+        peer.put_record(make_record(sha))
+    last_revision, shas = db.get_changes(revision)
+    assert last_revision == db.get_revision()
+    assert shas is None
+
+
+def test_dumped_counts(path):
+    db = EcgDatabase(path)
+    db.add_dumped_counts({"a": 2, "b": 1})
+    db.add_dumped_counts({"a": 1})
+    assert db.get_dumped_counts() == {"a": 3, "b": 1}
+
+
+def test_transaction_rolls_back(path):
+    db = EcgDatabase(path)
+    with pytest.raises(RuntimeError):
+        with db.transaction():
+            db.put_record(make_record("a"))
+            raise RuntimeError
+    assert db.get_records() == []
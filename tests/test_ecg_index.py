@@ -0,0 +1,109 @@
+from datetime import datetime
+
+import pytest
+
+from api.annotation.ecg_index import EcgIndex, _SortedList
+
+
+def make_index(items):
+    index = EcgIndex()
+    for sha, timestamp in items:
+        index.insert(sha, timestamp)
+    return index
+
+
+@pytest.fixture
+def index():
+    return make_index([
+        ("a", datetime(2018, 1, 1, 10)),
+        ("b", datetime(2018, 1, 2, 10)),
+        ("c", datetime(2018, 1, 2, 10)),
+        ("d", datetime(2018, 1, 3, 10)),
+        ("e", datetime(2018, 1, 4, 10)),
+    ])
+
+
+def test_order_is_descending_and_ties_keep_insertion_order(index):
+    assert index.query() == (["e", "d", "b", "c", "a"], 5)
+
+
+def test_insert_is_idempotent(index):
+    index.insert("a", datetime(2018, 1, 5))
+    assert len(index) == 5
+    assert index.query()[0][-1] == "a"
+
+
+def test_remove(index):
+    index.remove("b")
+    index.remove("unknown")
+    assert "b" not in index
+    assert index.query() == (["e", "d", "c", "a"], 4)
+
+
+def test_remove_of_a_tie_keeps_the_other(index):
+    index.remove("c")
+    assert index.query() == (["e", "d", "b", "a"], 4)
+
+
+@pytest.mark.parametrize("offset, limit, expected", [
+    (0, 2, ["e", "d"]),
+    (2, 2, ["b", "c"]),
+    (4, 2, ["a"]),
+    (5, 2, []),
+    (3, None, ["c", "a"]),
+])
+def test_paging(index, offset, limit, expected):
+    assert index.query(offset=offset, limit=limit) == (expected, 5)
+
+
+def test_date_bounds(index):
+    date_from = EcgIndex.parse_date("02.01.2018")
+    date_to = EcgIndex.parse_date("03.01.2018", is_end=True)
+    assert index.query(date_from, date_to) == (["d", "b", "c"], 3)
+
+
+def test_date_bounds_with_time(index):
+    date_from = EcgIndex.parse_date("02.01.2018 10:00:00")
+    date_to = EcgIndex.parse_date("03.01.2018 10:00:00")
+    assert index.query(date_from, date_to) == (["b", "c"], 2)
+
+
+def test_empty_date_range(index):
+    date_from = EcgIndex.parse_date("05.01.2018")
+    assert index.query(date_from=date_from) == ([], 0)
+    assert index.query(date_from=date_from, date_to=EcgIndex.parse_date("01.01.2018")) == ([], 0)
+
+
+def test_predicate_with_paging(index):
+    shas, total = index.query(predicate=lambda sha: sha != "d", offset=1, limit=2)
+    assert (shas, total) == (["b", "c"], 4)
+
+
+def test_get_next(index):
+    assert index.get_next("d", 2) == ["b", "c"]
+    assert index.get_next("c", 5) == ["a"]
+    assert index.get_next("a", 2) == []
+
+
+def test_get_timestamp(index):
+    assert index.get_timestamp("a") == "01.01.2018 10:00:00"
+
+
+def test_parse_invalid_date():
+    with pytest.raises(ValueError):
+        EcgIndex.parse_date("2018-01-01")
+
+
+def test_small_buckets_keep_the_order():
+    index = EcgIndex()
+    index.keys = _SortedList(load=2)
+    timestamps = [datetime(2018, 1, 1 + i % 7) for i in range(50)]
+    for i, timestamp in enumerate(timestamps):
+        index.insert(str(i), timestamp)
+    for i in range(0, 50, 3):
+        index.remove(str(i))
+    expected = sorted((str(i) for i in range(50) if i % 3), key=lambda sha: (timestamps[int(sha)], -int(sha)),
+                      reverse=True)
+    assert index.query() == (expected, len(expected))
+    assert index.query(offset=10, limit=5) == (expected[10:15], len(expected))
+    assert index.get_next(expected[20], 3) == expected[21:24]
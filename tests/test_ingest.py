@@ -0,0 +1,52 @@
+from api.annotation.ingest import coalesce_events
+
+
+def test_unrelated_events_are_kept():
+    events = [("created", "a", None), ("moved", "b", "c"), ("deleted", "d", None)]
+    assert coalesce_events(events) == events
+
+
+def test_repeated_creation_is_merged():
+    events = [("created", "a", None), ("created", "b", None), ("created", "a", None)]
+    assert coalesce_events(events) == [("created", "a", None), ("created", "b", None)]
+
+
+def test_created_then_moved():
+    events = [("created", "a", None), ("moved", "a", "b")]
+    assert coalesce_events(events) == [("created", "b", None)]
+
+
+def test_created_then_moved_twice():
+    events = [("created", "a", None), ("moved", "a", "b"), ("moved", "b", "c")]
+    assert coalesce_events(events) == [("created", "c", None)]
+
+
+def test_created_then_moved_over_created():
+    events = [("created", "a", None), ("created", "b", None), ("moved", "a", "b")]
+    assert coalesce_events(events) == [("created", "b", None)]
+
+
+def test_created_then_deleted():
+    # the deletion is kept, as the file may have existed before the batch
+    events = [("created", "a", None), ("deleted", "a", None)]
+    assert coalesce_events(events) == [("deleted", "a", None)]
+
+
+def test_created_moved_then_deleted():
+    events = [("created", "a", None), ("moved", "a", "b"), ("deleted", "b", None)]
+    assert coalesce_events(events) == [("deleted", "b", None)]
+
+
+def test_deleted_then_created():
+    events = [("deleted", "a", None), ("created", "a", None)]
+    assert coalesce_events(events) == events
+
+
+def test_moved_existing_file_is_kept():
+    events = [("moved", "a", "b"), ("created", "c", None), ("moved", "c", "d")]
+    assert coalesce_events(events) == [("moved", "a", "b"), ("created", "d", None)]
+
+
+def test_created_again_after_deletion():
+    events = [("created", "a", None), ("deleted", "a", None), ("created", "a", None)]
+    assert coalesce_events(events) == [("deleted", "a", None), ("created", "a", None)]
@@ -0,0 +1,96 @@
+import pytest
+
+from api.api_base import JobExecutor
+
+
+class ManualSpawn:
+    """Stand-in for a background task runner, that runs spawned jobs only when asked to."""
+
+    def __init__(self):
+        self.started = []
+
+    def __call__(self, target, *args):
+        self.started.append((target, args))
+
+    def run_next(self):
+        target, args = self.started.pop(0)
+        target(*args)
+
+
+@pytest.fixture
+def spawn():
+    return ManualSpawn()
+
+
+def make_target(log, name):
+    return lambda job: log.append((name, job.cancelled))
+
+
+def test_limits_and_backpressure(spawn):
+    executor = JobExecutor({"E": (1, 1)}, spawn)
+    log = []
+    executor.submit("1", "E", "sid", make_target(log, "1"))
+    executor.submit("2", "E", "sid", make_target(log, "2"))
+    with pytest.raises(RuntimeError):
+        executor.submit("3", "E", "sid", make_target(log, "3"))
+    assert len(spawn.started) == 1
+    spawn.run_next()
+    assert len(spawn.started) == 1
+    spawn.run_next()
+    assert log == [("1", False), ("2", False)]
+    assert executor.jobs == {}
+
+
+def test_cancel_queued_job(spawn):
+    executor = JobExecutor({"E": (1, 1)}, spawn)
+    log = []
+    executor.submit("1", "E", "sid", make_target(log, "1"))
+    executor.submit("2", "E", "sid", make_target(log, "2"), on_cancel=lambda: log.append("on_cancel"))
+    assert executor.cancel("2")
+    assert not executor.cancel("2")
+    spawn.run_next()
+    assert spawn.started == []
+    assert log == [("1", False)]
+
+
+def test_cancel_running_job(spawn):
+    executor = JobExecutor({"E": (1, 1)}, spawn)
+    log = []
+    executor.submit("1", "E", "sid", make_target(log, "1"), on_cancel=lambda: log.append("on_cancel"))
+    assert executor.cancel("1")
+    spawn.run_next()
+    assert log == ["on_cancel", ("1", True)]
+
+
+def test_key_replaces_running_and_queued_jobs(spawn):
+    executor = JobExecutor({"E": (1, 2)}, spawn)
+    log = []
+    executor.submit("1", "E", "a", make_target(log, "1"), key="k", on_cancel=lambda: log.append("cancel 1"))
+    executor.submit("2", "E", "a", make_target(log, "2"), key="k")
+    executor.submit("3", "E", "b", make_target(log, "3"), key="other")
+    executor.submit("4", "E", "a", make_target(log, "4"), key="k")
+    assert log == ["cancel 1"]
+    assert sorted(executor.jobs) == ["3", "4"]
+    while spawn.started:
+        spawn.run_next()
+    assert log == ["cancel 1", ("1", True), ("3", False), ("4", False)]
+
+
+def test_cancel_sid(spawn):
+    executor = JobExecutor({"E": (1, 2)}, spawn)
+    log = []
+    executor.submit("1", "E", "a", make_target(log, "1"))
+    executor.submit("2", "E", "b", make_target(log, "2"))
+    executor.submit("3", "E", "a", make_target(log, "3"))
+    assert executor.cancel_sid("a") == 2
+    while spawn.started:
+        spawn.run_next()
+    assert log == [("1", True), ("2", False)]
+
+
+def test_events_have_separate_limits(spawn):
+    executor = JobExecutor({"E": (1, 0), "F": (1, 0)}, spawn)
+    executor.submit("1", "E", "sid", lambda job: None)
+    executor.submit("2", "F", "sid", lambda job: None)
+    assert len(spawn.started) == 2
+    assert "E" in executor and "G" not in executor
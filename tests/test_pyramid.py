@@ -0,0 +1,65 @@
+import numpy as np
+import pytest
+
+from api.pyramid import SignalPyramid, parse_window
+
+
+@pytest.fixture
+def signal():
+    return np.random.RandomState(0).randint(-1000, 1000, (12, 5000)).astype(np.int16)
+
+
+def count_points(window):
+    if window["bin_size"] == 1:
+        return window["signal"].shape[-1]
+    return 2 * window["min"].shape[-1]
+
+
+def test_short_window_is_raw(signal):
+    window = SignalPyramid(signal).get_window(100, 300, 500, "ndarray")
+    assert window["bin_size"] == 1
+    assert np.array_equal(window["signal"], signal[:, 100:300])
+
+
+@pytest.mark.parametrize("start, end, max_points", [
+    (0, 5000, 100),
+    (0, 5000, 2),
+    (1, 5000, 3),
+    (4095, 4097, 2),
+    (17, 4321, 257),
+    (0, 5000, 4999),
+])
+def test_window_has_at_most_max_points(signal, start, end, max_points):
+    window = SignalPyramid(signal).get_window(start, end, max_points, "ndarray")
+    assert count_points(window) <= max_points
+    assert window["start"] <= start and window["end"] >= end
+
+
+def test_window_holds_bin_extremes(signal):
+    window = SignalPyramid(signal).get_window(10, 5000, 100, "ndarray")
+    bin_size = window["bin_size"]
+    starts = range(window["start"], window["end"], bin_size)
+    assert np.array_equal(window["min"], np.stack([signal[:, i:i + bin_size].min(axis=1) for i in starts], axis=1))
+    assert np.array_equal(window["max"], np.stack([signal[:, i:i + bin_size].max(axis=1) for i in starts], axis=1))
+
+
+def test_window_is_clipped(signal):
+    window = SignalPyramid(signal).get_window(4900, 6000, 1000, "ndarray")
+    assert (window["start"], window["end"]) == (4900, 5000)
+
+
+def test_gain_is_applied(signal):
+    gain = np.arange(1, 13) / 1000
+    window = SignalPyramid(signal, gain=gain).get_window(0, 10, 10, "ndarray")
+    assert np.allclose(window["signal"], signal[:, :10] * gain[:, None])
+
+
+@pytest.mark.parametrize("data", [
+    {"start": 0, "end": 10},
+    {"start": -1, "end": 10, "max_points": 10},
+    {"start": 0, "end": 10, "max_points": 1},
+    {"start": 0.5, "end": 10, "max_points": 10},
+])
+def test_parse_invalid_window(data):
+    with pytest.raises(ValueError):
+        parse_window(data)
@@ -0,0 +1,127 @@
+import time
+import threading
+
+import pytest
+
+from api.annotation.rwlock import ReadWriteLock
+
+
+def run_in_thread(target):
+    thread = threading.Thread(target=target, daemon=True)
+    thread.start()
+    return thread
+
+
+def test_read_is_reentrant():
+    lock = ReadWriteLock()
+    with lock.read():
+        with lock.read():
+            assert lock.n_readers == 2
+    assert lock.n_readers == 0
+
+
+def test_write_is_reentrant():
+    lock = ReadWriteLock()
+    with lock.write():
+        with lock.write():
+            assert lock.n_writes == 2
+        assert lock.writer == threading.get_ident()
+    assert lock.writer is None
+
+
+def test_writer_can_read():
+    lock = ReadWriteLock()
+    with lock.write():
+        with lock.read():
+            assert lock.n_readers == 1
+    assert lock.n_readers == 0 and lock.writer is None
+
+
+def test_read_can_not_be_upgraded():
+    lock = ReadWriteLock()
+    with lock.read():
+        with pytest.raises(RuntimeError):
+            lock.acquire_write()
+    assert lock.n_waiting_writers == 0
+    with lock.write():
+        pass
+
+
+def test_readers_share_the_lock():
+    lock = ReadWriteLock()
+    acquired = threading.Event()
+
+    def read():
+        with lock.read():
+            acquired.set()
+
+    with lock.read():
+        run_in_thread(read).join(1)
+    assert acquired.is_set()
+
+
+def test_writer_excludes_readers():
+    lock = ReadWriteLock()
+    acquired = threading.Event()
+
+    def read():
+        with lock.read():
+            acquired.set()
+
+    with lock.write():
+        thread = run_in_thread(read)
+        assert not acquired.wait(0.1)
+    thread.join(1)
+    assert acquired.is_set()
+
+
+def test_reentrant_read_is_not_blocked_by_waiting_writer():
+    lock = ReadWriteLock()
+    written = threading.Event()
+
+    def write():
+        with lock.write():
+            written.set()
+
+    with lock.read():
+        thread = run_in_thread(write)
+        while not lock.n_waiting_writers:
+            pass
+        with lock.read():
+            assert not written.is_set()
+    thread.join(1)
+    assert written.is_set()
+
+
+def test_waiting_writer_blocks_new_readers():
+    lock = ReadWriteLock()
+    order = []
+
+    def write():
+        with lock.write():
+            order.append("write")
+
+    def read():
+        with lock.read():
+            order.append("read")
+
+    with lock.read():
+        writer = run_in_thread(write)
+        while not lock.n_waiting_writers:
+            pass
+        reader = run_in_thread(read)
+        time.sleep(0.1)
+        assert order == [] and lock.n_readers == 1
+    writer.join(1)
+    reader.join(1)
+    assert order == ["write", "read"]
+
+
+def test_on_wait_is_called():
+    waits = []
+    lock = ReadWriteLock(on_wait=lambda kind, seconds: waits.append(kind))
+    with lock.write():
+        pass
+    with lock.read():
+        pass
+    assert waits == ["write", "read"]
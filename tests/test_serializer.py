@@ -0,0 +1,66 @@
+import zlib
+
+import numpy as np
+import pytest
+
+from api.serializer import NDARRAY_EXT_TYPE, JsonSerializer, MsgpackSerializer, create_serializer
+
+msgpack = pytest.importorskip("msgpack")
+
+
+def unpack_ext(code, data):
+    assert code == NDARRAY_EXT_TYPE
+    dtype, shape, buffer = msgpack.unpackb(data)
+    return np.frombuffer(buffer, dtype=dtype).reshape(shape)
+
+
+def unpack(serialized):
+    buffer = serialized["payload"]
+    if serialized["compression"] == "zlib":
+        buffer = zlib.decompress(buffer)
+    return msgpack.unpackb(buffer, ext_hook=unpack_ext, raw=False)
+
+
+def test_arrays_round_trip():
+    payload = {"data": {"signal": np.arange(24, dtype=np.int16).reshape(2, 3, 4)[:, ::2],
+                        "mask": np.ones(3, dtype=">f4"), "fs": np.int64(500), "scale": np.float32(0.5)},
+               "meta": {"id": 1}}
+    serialized = MsgpackSerializer().serialize(payload)
+    assert (serialized["codec"], serialized["compression"], serialized["meta"]) == ("msgpack", None, {"id": 1})
+    data = unpack(serialized)["data"]
+    assert np.array_equal(data["signal"], payload["data"]["signal"])
+    assert data["signal"].dtype == np.int16
+    assert np.array_equal(data["mask"], np.ones(3))
+    assert (data["fs"], data["scale"]) == (500, 0.5)
+
+
+def test_large_payloads_are_compressed():
+    serializer = MsgpackSerializer("zlib", threshold=1000)
+    small = serializer.serialize({"data": np.zeros(10, dtype=np.int16), "meta": None})
+    large = serializer.serialize({"data": np.zeros(10000, dtype=np.int16), "meta": None})
+    assert small["compression"] is None
+    assert large["compression"] == "zlib"
+    assert len(large["payload"]) < 20000
+    assert np.array_equal(unpack(large)["data"], np.zeros(10000))
+
+
+def test_unsupported_objects_are_rejected():
+    with pytest.raises(TypeError):
+        MsgpackSerializer().serialize({"data": object()})
+
+
+def test_create_serializer():
+    assert isinstance(create_serializer(), JsonSerializer)
+    assert isinstance(create_serializer("msgpack", "zlib"), MsgpackSerializer)
+    payload = {"data": [1]}
+    assert create_serializer("json").serialize(payload) is payload
+
+
+@pytest.mark.parametrize("name, compression", [
+    ("json", "zlib"),
+    ("xml", None),
+    ("msgpack", "brotli"),
+])
+def test_create_invalid_serializer(name, compression):
+    with pytest.raises(ValueError):
+        create_serializer(name, compression)
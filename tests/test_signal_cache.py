@@ -0,0 +1,107 @@
+import os
+from datetime import datetime
+
+import numpy as np
+import pytest
+
+from api.annotation.cache import SignalCache
+
+
+def make_signal_data(path, signal):
+    stat = os.stat(path)
+    meta = {"fs": np.int64(500), "units": ["mV", "mV"], "signame": ["I", "II"], "gain": [0.001, 0.001],
+            "timestamp": datetime(2018, 1, 1, 10)}
+    return {"file_name": os.path.basename(path), "file_size": stat.st_size, "modification_time": stat.st_mtime,
+            "signal": signal, "meta": meta, "annotation": []}
+
+
+@pytest.fixture
+def ecg_path(tmp_path):
+    path = tmp_path / "ecg.xml"
+    path.write_bytes(b"<ecg/>")
+    return str(path)
+
+
+@pytest.fixture
+def signal():
+    return np.arange(20, dtype=np.int16).reshape(2, 10)
+
+
+def test_hit(tmp_path, ecg_path, signal):
+    cache = SignalCache(str(tmp_path / "cache"))
+    cache.put(ecg_path, "sha", make_signal_data(ecg_path, signal))
+    sha, signal_data = cache.get(ecg_path)
+    assert sha == "sha"
+    assert np.array_equal(signal_data["signal"], signal)
+    assert signal_data["meta"]["gain"] == [0.001, 0.001]
+    assert "signal" not in cache.get(ecg_path, load_signal=False)[1]
+
+
+def test_index_is_persisted(tmp_path, ecg_path, signal):
+    cache = SignalCache(str(tmp_path / "cache"))
+    cache.put(ecg_path, "sha", make_signal_data(ecg_path, signal))
+    cache.dump()
+    sha, signal_data = SignalCache(str(tmp_path / "cache")).get(ecg_path)
+    assert (sha, signal_data["meta"]["fs"]) == ("sha", 500)
+    assert signal_data["meta"]["timestamp"] == datetime(2018, 1, 1, 10)
+
+
+def test_changed_file_is_a_miss(tmp_path, ecg_path, signal):
+    cache = SignalCache(str(tmp_path / "cache"))
+    cache.put(ecg_path, "sha", make_signal_data(ecg_path, signal))
+    with open(ecg_path, "ab") as f:
+        f.write(b" ")
+    assert cache.get(ecg_path) is None
+
+
+def test_modified_file_is_a_miss(tmp_path, ecg_path, signal):
+    cache = SignalCache(str(tmp_path / "cache"))
+    cache.put(ecg_path, "sha", make_signal_data(ecg_path, signal))
+    stat = os.stat(ecg_path)
+    os.utime(ecg_path, (stat.st_atime, stat.st_mtime + 10))
+    assert cache.get(ecg_path) is None
+
+
+def test_missing_file_is_a_miss(tmp_path, ecg_path, signal):
+    cache = SignalCache(str(tmp_path / "cache"))
+    cache.put(ecg_path, "sha", make_signal_data(ecg_path, signal))
+    os.remove(ecg_path)
+    assert cache.get(ecg_path) is None
+
+
+def test_corrupted_signal_is_rebuilt(tmp_path, ecg_path, signal):
+    cache = SignalCache(str(tmp_path / "cache"))
+    signal_data = make_signal_data(ecg_path, signal)
+    cache.put(ecg_path, "sha", dict(signal_data))
+    signal_path = cache._signal_path("sha")
+    with open(signal_path, "r+b") as f:
+        f.truncate(20)
+    assert cache.get(ecg_path) is None
+    assert not os.path.exists(signal_path)
+    cache.put(ecg_path, "sha", signal_data)
+    assert np.array_equal(cache.get(ecg_path)[1]["signal"], signal)
+
+
+def test_no_temporary_files_are_left(tmp_path, ecg_path, signal):
+    cache_dir = str(tmp_path / "cache")
+    cache = SignalCache(cache_dir)
+    cache.put(ecg_path, "sha", make_signal_data(ecg_path, signal))
+    cache.dump()
+    assert sorted(os.listdir(cache_dir)) == ["index.json", "sha.counts.npy"]
+
+
+def test_prune(tmp_path, ecg_path, signal):
+    cache_dir = str(tmp_path / "cache")
+    cache = SignalCache(cache_dir)
+    cache.put(ecg_path, "sha", make_signal_data(ecg_path, signal))
+    cache.put(ecg_path + ".old", "old", make_signal_data(ecg_path, signal))
+    cache.prune([ecg_path])
+    assert sorted(os.listdir(cache_dir)) == ["sha.counts.npy"]
+    assert cache.get(ecg_path + ".old") is None
+
+
+def test_corrupted_index_is_rebuilt(tmp_path):
+    cache_dir = tmp_path / "cache"
+    cache_dir.mkdir()
+    (cache_dir / "index.json").write_text("{")
+    assert SignalCache(str(cache_dir)).index == {}